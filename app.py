@@ -3,6 +3,7 @@ import time
 import threading
 import requests
 import os
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
 from flask import Flask, request, jsonify, render_template, redirect, url_for, flash
 from flask_bootstrap import Bootstrap4
@@ -19,8 +20,20 @@ load_dotenv()
 
 import database
 import logger_setup
-from file_parser import parse_filename
-from fichier_dl import FichierDownloader, get_filename_from_url, DownloadCancelledError
+import browser_pool
+from fichier_dl import FichierDownloader, DownloadCancelledError, DownloadDeferredError, InsufficientSpaceError
+from link_metadata import get_link_metadata, prefetch_waiting_metadata
+from liveness import check_links, liveness_sweeper
+from archive import archiver
+from scheduler import scheduler
+from progress_store import progress_store
+from queue_stream import queue_stream
+from cancellation import cancellations
+from bandwidth import bandwidth_limiter
+from dedup import DEDUP_MODE, find_duplicate
+from disk_space import disk_space
+from postprocess import post_processor
+from telegram_notifier import notifier
 from telegram_bot import start_bot
 from auth import login_manager, User, authenticate_user
 
@@ -123,7 +136,7 @@ def index():
 @app.route('/queue')
 @login_required
 def queue():
-    return render_template('queue.html')
+    return render_template('queue.html', priority_gap=database.PRIORITY_GAP)
 
 # --- API Endpoints ---
 
@@ -132,172 +145,355 @@ def queue():
 def submit_links():
     form = LinkSubmissionForm()
     if form.validate_on_submit():
-        links = form.links.data.strip().splitlines()
+        links = [link.strip() for link in form.links.data.strip().splitlines() if '1fichier.com' in link]
+        # Skip the page fetches for links that are known already; the insert itself still rejects duplicates.
+        links = [link for link in links if not database.is_link_already_added(link)]
         if not links:
             return redirect(url_for('index'))
 
-        for link in links:
-            if '1fichier.com' not in link:
-                continue
-            
-            filename = get_filename_from_url(link)
+        # Dead links are dropped right away instead of waiting for a worker to find out.
+        liveness = check_links(links)
+        for link in [link for link in links if liveness.get(link) is False]:
+            log.warning(f"File behind {link} no longer exists, not queuing it.")
+        links = [link for link in links if liveness.get(link) is not False]
+
+        # Lookups hit the metadata cache first and share the browser pool otherwise, so run them in parallel.
+        with ThreadPoolExecutor(max_workers=browser_pool.POOL_SIZE) as executor:
+            metadata_list = list(executor.map(get_link_metadata, links))
 
-            if not filename:
-                log.error(f"Could not determine filename for link using Selenium: {link}")
+        for link, metadata in zip(links, metadata_list):
+            if not metadata:
+                log.error(f"Could not determine filename for link: {link}")
                 continue
 
-            media_info = parse_filename(filename)
-
-            request_id = database.add_request(
-                media_info.get('title', 'Unknown Title'), 
-                media_info.get('type', 'unknown'), 
-                media_info.get('season')
-            )
-            
-            with database.get_db_conn() as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT INTO downloads (request_id, episode_number, quality, language, fichier_link, status, priority) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                    (
-                        request_id, 
-                        media_info.get('episode'), 
-                        media_info.get('quality'), 
-                        media_info.get('language'), 
-                        link, 
-                        'queued',
-                        time.time()
-                    )
-                )
-                conn.commit()
+            if database.add_link_download(link, metadata['media_info']) is None:
+                log.warning(f"Link {link} is already in the database. Skipping.")
+
+        scheduler.notify()
 
     return redirect(url_for('queue'))
 
 @app.route('/api/queue', methods=['GET'])
 @login_required
 def get_queue():
-    downloads = database.get_all_downloads()
-    return jsonify(downloads)
+    """
+    The whole queue as a list, or with ?since=<version> only what changed after that version:
+    {"version", "changed", "deleted", "complete"}. The ETag is the queue version, so a poll
+    with a matching If-None-Match gets a 304 without touching the rows. Live progress comes
+    from the progress store, and reaches the version counter each time it is flushed.
+    """
+    version = database.get_queue_version()
+    if request.if_none_match.contains(str(version)):
+        response = app.response_class(status=304)
+    elif 'since' in request.args:
+        version, changed, deleted, complete = database.get_queue_changes(request.args.get('since', 0, type=int))
+        response = jsonify({
+            'version': version,
+            'changed': progress_store.overlay(changed),
+            'deleted': deleted,
+            'complete': complete,
+        })
+    else:
+        response = jsonify(progress_store.overlay(database.get_all_downloads()))
+    response.set_etag(str(version))
+    # Let the page decide what to revalidate instead of the browser cache.
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/queue/stream', methods=['GET'])
+@login_required
+def stream_queue():
+    """
+    Server-Sent Events with the queue changes after ?since=<version> (or after the
+    Last-Event-ID of a reconnecting browser), pushed as they happen. Answers 503 when
+    too many viewers are connected, and the page keeps polling /api/queue instead.
+    """
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    events = queue_stream.open(since)
+    if events is None:
+        return jsonify({"error": "Too many live viewers, poll /api/queue instead"}), 503
+    response = app.response_class(events, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Keeps reverse proxies from buffering the stream.
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/history', methods=['GET'])
+@login_required
+def get_history():
+    """Archived jobs, most recent first: ?page=1&per_page=50, optionally &status=completed|failed|dead."""
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = min(200, max(1, request.args.get('per_page', 50, type=int)))
+    items, total = database.get_download_history(page, per_page, request.args.get('status'))
+    return jsonify({
+        'items': items,
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'pages': (total + per_page - 1) // per_page,
+    })
+
+@app.route('/api/workers', methods=['GET'])
+@login_required
+def get_workers():
+    return jsonify(get_worker_status())
+
+@app.route('/api/metrics', methods=['GET'])
+@login_required
+def get_metrics():
+    resolver_counts = database.get_resolver_stats()
+    resolved_total = sum(resolver_counts.values())
+    return jsonify({
+        'filename_browsers': browser_pool.get_shared_pool().stats(),
+        'worker_browsers': {name: downloader.browser_stats() for name, downloader in list(worker_downloaders.items())},
+        'cancellations': cancellations.stats(),
+        'bandwidth': bandwidth_limiter.stats(),
+        'disk': disk_space.stats(),
+        'postprocess': post_processor.stats(),
+        'db_writer': database.writer.stats(),
+        'queue_stream': queue_stream.stats(),
+        'notifications': notifier.stats(),
+        'resolvers': {
+            'counts': resolver_counts,
+            'http_hit_rate': round(resolver_counts.get('http', 0) / resolved_total, 3) if resolved_total else None
+        }
+    })
+
+@app.route('/api/disk', methods=['GET'])
+@login_required
+def get_disk_space():
+    return jsonify(disk_space.stats())
+
+@app.route('/api/bandwidth', methods=['GET'])
+@login_required
+def get_bandwidth():
+    return jsonify(bandwidth_limiter.stats())
+
+@app.route('/api/bandwidth', methods=['POST'])
+@login_required
+def update_bandwidth():
+    data = request.get_json() or {}
+    try:
+        bandwidth_limiter.configure(
+            default_limit_kib=data.get('default_limit_kib'),
+            schedule=data.get('schedule'),
+            job_limits_kib=data.get('job_limits_kib')
+        )
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return jsonify({"error": f"Invalid bandwidth configuration: {e}"}), 400
+    return jsonify(bandwidth_limiter.stats())
 
 @app.route('/api/downloads/<int:download_id>/delete', methods=['POST'])
 @login_required
 def delete_download_api(download_id):
+    download = database.get_download_by_id(download_id)
     database.delete_download(download_id)
+    progress_store.discard(download_id)
+    bandwidth_limiter.forget(download_id)
+    if cancellations.cancel(download_id):
+        # The worker removes its own .part file when it notices the cancellation.
+        log.info(f"Signalled the worker handling download {download_id} to stop.")
+    elif download and download.get('part_path'):
+        # No worker owns the job (queued, or parked for a cooldown), so nothing else will clean up.
+        try:
+            os.remove(download['part_path'])
+        except OSError:
+            pass
     log.info(f"Deleted download {download_id} via API.")
     return jsonify({"message": "Download deleted"})
 
 @app.route('/api/downloads/<int:download_id>/priority', methods=['POST'])
 @login_required
 def change_priority_api(download_id):
-    data = request.get_json()
+    """
+    Moves a job in the queue. The body is one of {"before": id}, {"after": id} or
+    {"direction": "up" | "down" | "top" | "bottom"}. Only the moved job's row is rewritten.
+    """
+    data = request.get_json() or {}
     direction = data.get('direction')
 
-    if direction not in ['up', 'down']:
-        return jsonify({"error": "Invalid direction"}), 400
-
-    all_downloads = database.get_all_downloads()
-    
     try:
-        current_index = next(i for i, d in enumerate(all_downloads) if d['id'] == download_id)
-    except StopIteration:
+        if 'before' in data or 'after' in data:
+            try:
+                before_id = int(data['before']) if data.get('before') is not None else None
+                after_id = int(data['after']) if data.get('after') is not None else None
+                found = database.move_download(download_id, before_id=before_id, after_id=after_id)
+            except (TypeError, ValueError):
+                return jsonify({"error": "Pass either 'before' or 'after' as a download id"}), 400
+        elif direction in ['up', 'down']:
+            found = database.move_download_step(download_id, direction)
+        elif direction == 'top':
+            found = database.move_download_to_top(download_id)
+        elif direction == 'bottom':
+            found = database.move_download_to_bottom(download_id)
+        else:
+            return jsonify({"error": "Invalid direction"}), 400
+    except database.QueueMoveError as e:
+        log.error(f"Could not move download {download_id}: {e}")
+        return jsonify({"error": "Could not move the download, try again"}), 409
+
+    if not found:
         return jsonify({"error": "Download not found"}), 404
-
-    if direction == 'up':
-        if current_index == 0:
-            return jsonify({"message": "Already at top"})
-        
-        swap_with_index = current_index - 1
-        
-    elif direction == 'down':
-        if current_index == len(all_downloads) - 1:
-            return jsonify({"message": "Already at bottom"})
-            
-        swap_with_index = current_index + 1
-
-    all_downloads.insert(swap_with_index, all_downloads.pop(current_index))
-    
-    download_ids = [d['id'] for d in all_downloads]
-    database.update_priorities(download_ids)
-
     return jsonify({"message": "Priority updated"})
 
 # --- Background Tasks --- #
 
-def download_worker():
-    log.info("[Worker]: Download worker thread started.")
+NUM_WORKERS = max(1, int(os.getenv('DOWNLOAD_WORKERS', 2)))
+# Parallel connections per file. 1 keeps the classic single-stream transfer.
+DOWNLOAD_SEGMENTS = max(1, int(os.getenv('DOWNLOAD_SEGMENTS', 1)))
+# Resolve 1fichier pages over plain HTTP and only start Chrome as a fallback.
+USE_HTTP_RESOLVER = os.getenv('HTTP_RESOLVER', 'true').lower() in ('1', 'true', 'yes')
+# Render tqdm progress bars in the console (disable for headless deployments).
+SHOW_PROGRESS_BAR = os.getenv('PROGRESS_BAR', 'true').lower() in ('1', 'true', 'yes')
+
+worker_status = {}
+worker_status_lock = threading.Lock()
+# Each worker's downloader, so the metrics can report on its browser session.
+worker_downloaders = {}
+
+def set_worker_status(worker_name, state, job_id=None):
+    """Records what a worker is currently doing, for the API and the logs."""
+    with worker_status_lock:
+        previous = worker_status.get(worker_name, {})
+        if previous.get('state') != state or previous.get('job_id') != job_id:
+            log.info(f"[{worker_name}]: State -> {state}" + (f" (job {job_id})" if job_id else ""))
+        worker_status[worker_name] = {
+            'name': worker_name,
+            'state': state,
+            'job_id': job_id,
+            'since': time.time() if previous.get('state') != state else previous.get('since')
+        }
+
+def get_worker_status():
+    with worker_status_lock:
+        return [dict(status) for status in worker_status.values()]
+
+def download_worker(worker_name):
+    log.info(f"[{worker_name}]: Download worker thread started.")
+    set_worker_status(worker_name, 'starting')
     time.sleep(5)
-    downloader = FichierDownloader()
-    downloader.start_session()
+    downloader = FichierDownloader(segments=DOWNLOAD_SEGMENTS, use_http_resolver=USE_HTTP_RESOLVER, defer_cooldowns=True, show_progress_bar=SHOW_PROGRESS_BAR,
+                                   duplicate_finder=find_duplicate if DEDUP_MODE != 'off' else None)
+    worker_downloaders[worker_name] = downloader
+    if not USE_HTTP_RESOLVER:
+        downloader.start_session()
 
     try:
         while True:
-            pending_downloads = database.get_pending_downloads()
-            if not pending_downloads:
-                time.sleep(10)
-                continue
+            # Long-lived Chrome sessions grow over time; restart them between jobs, never mid-transfer.
+            downloader.recycle_session_if_needed()
 
-            download_job = pending_downloads[0]
-            
-            # --- Pre-download check ---
-            # Verify that the job hasn't been deleted by the user since being queued.
-            if not database.get_download_by_id(download_job['id']):
-                log.warning(f"[Worker]: Job {download_job['id']} was deleted from the queue. Skipping.")
-                continue
+            # Claiming the job marks it as 'processing', so no other worker can pick it up.
+            download_job = scheduler.next_job(worker_name, lambda state: set_worker_status(worker_name, state))
+            set_worker_status(worker_name, 'busy', download_job['id'])
 
-            if download_job['status'] != 'queued':
+            # Deleting the job through the API cancels this token, no database polling needed.
+            cancellation_token = cancellations.register(download_job['id'])
+            if not database.get_download_by_id(download_job['id']):
+                log.warning(f"[{worker_name}]: Job {download_job['id']} was deleted from the queue. Skipping.")
+                cancellations.release(download_job['id'])
+                # The scheduler reserved disk space when it admitted the job.
+                disk_space.release(download_job['id'])
                 continue
-
-            log.info(f"[Worker]: Starting job {download_job['id']} for link: {download_job['fichier_link']}")
+            log.info(f"[{worker_name}]: Starting job {download_job['id']} for link: {download_job['fichier_link']}")
 
             def status_callback(status, progress=None):
-                # To prevent errors if the job is deleted mid-process, check if it still exists.
-                if database.get_download_by_id(download_job['id']):
-                    # Log status changes, but not every single progress update for 'downloading'.
-                    if status not in ['downloading', 'pending'] or progress in [0, 100]:
-                        log.info(f"[Job {download_job['id']}]: Status -> {status}, Progress -> {progress if progress is not None else 'N/A'}%")
-                    database.update_download_status(download_job['id'], status, progress)
+                # Log status changes, but not every single progress update for 'downloading'.
+                if status not in ['downloading', 'pending'] or progress in [0, 100]:
+                    log.info(f"[Job {download_job['id']}]: Status -> {status}, Progress -> {progress if progress is not None else 'N/A'}%")
+                # Progress stays in memory; only status transitions hit the database right away.
+                progress_store.update(download_job['id'], status, progress)
+
+            def checkpoint_callback(part_path, offset, total_size):
+                database.update_download_checkpoint(download_job['id'], part_path, offset, total_size or None)
 
-            def cancellation_callback():
-                """Returns True if the download job has been deleted."""
-                return database.get_download_by_id(download_job['id']) is None
+            resume = None
+            if download_job.get('part_path'):
+                resume = {'part_path': download_job['part_path'], 'offset': download_job.get('bytes_downloaded') or 0}
+                log.info(f"[{worker_name}]: Job {download_job['id']} has a partial transfer at byte {resume['offset']}.")
 
             try:
-                success = downloader.download_file(
-                    download_job['fichier_link'], 
-                    status_callback,
-                    cancellation_callback
-                )
+                try:
+                    success = downloader.download_file(
+                        download_job['fichier_link'], 
+                        status_callback,
+                        cancellation_token,
+                        resume=resume,
+                        checkpoint_callback=checkpoint_callback,
+                        throttle=lambda nbytes: bandwidth_limiter.throttle(download_job['id'], nbytes, cancellation_token),
+                        reserve_space=lambda size, part_path: disk_space.reserve(download_job['id'], size, part_path),
+                        download_id=download_job['id']
+                    )
+                finally:
+                    progress_store.finish(download_job['id'])
+                    cancellations.release(download_job['id'])
+                    bandwidth_limiter.release(download_job['id'])
+                    disk_space.release(download_job['id'])
+                    # Recorded whatever happens next, so the resolver stats also count jobs that fail, park or get cancelled.
+                    if downloader.last_resolver:
+                        database.update_download_resolver(download_job['id'], downloader.last_resolver)
                 
                 if success:
-                    log.info(f"[Worker]: Finished processing job {download_job['id']}.")
+                    log.info(f"[{worker_name}]: Finished processing job {download_job['id']}.")
                     database.update_download_status(download_job['id'], 'completed', 100)
+                    bandwidth_limiter.forget(download_job['id'])
+                    if downloader.last_file:
+                        database.update_download_file(
+                            download_job['id'],
+                            downloader.last_file['file_path'],
+                            downloader.last_file['size'],
+                            downloader.last_file['probe_hash'],
+                            downloader.last_file['content_hash']
+                        )
+                        # Metadata, library placement and the notification run off this thread.
+                        post_processor.submit(download_job['id'], downloader.last_file)
+                    job_info = database.get_download_by_id(download_job['id'])
+                    if job_info:
+                        database.save_link_metadata(download_job['fichier_link'], size=job_info['total_bytes'], alive=True)
                 else:
                     # If the job failed (but wasn't cancelled), it will still exist in the DB.
                     job_info = database.get_download_by_id(download_job['id'])
                     if job_info:
-                        log.warning(f"[Worker]: Job {download_job['id']} failed. Checking retry count.")
+                        log.warning(f"[{worker_name}]: Job {download_job['id']} failed. Checking retry count.")
                         database.increment_retry_count(download_job['id'])
                         # Re-fetch to get the updated retry count
                         job_info = database.get_download_by_id(download_job['id'])
                         if job_info['retries'] > 1:
-                            log.error(f"[Worker]: Job {download_job['id']} has exceeded max retries. Marking as failed.")
+                            log.error(f"[{worker_name}]: Job {download_job['id']} has exceeded max retries. Marking as failed.")
                             database.update_download_status(download_job['id'], 'failed')
+                            bandwidth_limiter.forget(download_job['id'])
                         else:
-                            log.info(f"[Worker]: Job {download_job['id']} will be retried. Resetting status to queued.")
+                            log.info(f"[{worker_name}]: Job {download_job['id']} will be retried. Resetting status to queued.")
                             database.update_download_status(download_job['id'], 'queued')
                     # If job_info is None, it was cancelled, and we just loop to the next job.
 
+            except DownloadDeferredError as e:
+                # 1fichier asked us to wait: park the job and let the worker move on.
+                scheduler.park(download_job['id'], e.wait_seconds)
+
+            except InsufficientSpaceError:
+                # The exact size turned out not to fit: set the job aside without holding back the queue.
+                scheduler.defer_for_space(download_job['id'])
+
             except Exception as e:
-                log.error(f"[Worker]: An unexpected error occurred while processing job {download_job['id']}: {e}", exc_info=True)
+                log.error(f"[{worker_name}]: An unexpected error occurred while processing job {download_job['id']}: {e}", exc_info=True)
                 # Check if job exists before updating its status to failed.
                 if database.get_download_by_id(download_job['id']):
                     database.update_download_status(download_job['id'], 'failed')
+                bandwidth_limiter.forget(download_job['id'])
                 continue
 
     finally:
+        set_worker_status(worker_name, 'stopped')
         downloader.stop_session()
 
 # --- Main Execution ---
 
+# Server threads for ordinary requests; open queue streams get threads of their own on top.
+WEB_THREADS = max(1, int(os.getenv('WEB_THREADS', 4)))
+
 if __name__ == '__main__':
     database.reset_stale_downloads()
 
@@ -306,10 +502,28 @@ if __name__ == '__main__':
     bot_thread.daemon = True
     bot_thread.start()
 
-    # Start the download worker in a background thread
-    worker_thread = threading.Thread(target=download_worker, name="DownloadWorker")
-    worker_thread.daemon = True
-    worker_thread.start()
+    progress_store.start()
+    queue_stream.start()
+    post_processor.resume_unfinished()
+    liveness_sweeper.start()
+    archiver.start()
+
+    # Work done by idle workers while the queue is empty or a cooldown is running
+    scheduler.register_idle_task('prefetch-metadata', prefetch_waiting_metadata)
+
+    # Start the pool of download workers, each with its own browser session
+    log.info(f"Starting {NUM_WORKERS} download worker(s).")
+    for i in range(1, NUM_WORKERS + 1):
+        worker_name = f"DownloadWorker-{i}"
+        worker_thread = threading.Thread(target=download_worker, args=(worker_name,), name=worker_name)
+        worker_thread.daemon = True
+        worker_thread.start()
 
     log.info("Starting production server on http://0.0.0.0:5000")
-    serve(app, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Every open queue stream parks one server thread, so they get threads and connections of their own.
+    serve(
+        app, host='0.0.0.0', port=5000,
+        threads=WEB_THREADS + queue_stream.max_connections,
+        connection_limit=100 + queue_stream.max_connections,
+        asyncore_use_poll=True
+    )
\ No newline at end of file
@@ -0,0 +1,54 @@
+import os
+import time
+import logging
+import threading
+
+import database
+
+log = logging.getLogger(__name__)
+
+# --- Archive Configuration ---
+# Completed, failed and dead jobs stay in the queue this many days before moving to the history.
+RETENTION_SECONDS = float(os.getenv('ARCHIVE_AFTER_DAYS', 7)) * 86400
+# Jobs moved per write command, so archiving a large backlog never holds up other writes for long.
+BATCH_SIZE = 500
+INTERVAL_SECONDS = 3600
+# Deleted jobs are remembered this long for /api/queue?since=; older pollers reload the whole queue.
+TOMBSTONE_SECONDS = 86400
+
+def archive_finished(retention_seconds=RETENTION_SECONDS):
+    """Moves every job that finished more than `retention_seconds` ago to the archive. Returns how many were moved."""
+    finished_before = time.time() - retention_seconds
+    archived = 0
+    while True:
+        moved = database.archive_finished_downloads(finished_before, BATCH_SIZE)
+        archived += moved
+        if moved < BATCH_SIZE:
+            break
+    if archived:
+        log.info(f"Archived {archived} finished download(s).")
+    return archived
+
+class Archiver:
+    """Keeps the queue tables down to active work by periodically archiving finished jobs."""
+
+    def __init__(self, retention_seconds=RETENTION_SECONDS, interval=INTERVAL_SECONDS):
+        self.retention_seconds = retention_seconds
+        self.interval = interval
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._archive_loop, name="Archiver", daemon=True)
+            self._thread.start()
+
+    def _archive_loop(self):
+        while True:
+            try:
+                archive_finished(self.retention_seconds)
+                database.prune_deleted_downloads(time.time() - TOMBSTONE_SECONDS)
+            except Exception as e:
+                log.error(f"Archiving finished downloads failed: {e}", exc_info=True)
+            time.sleep(self.interval)
+
+archiver = Archiver()
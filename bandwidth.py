@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+
+# --- Bandwidth Configuration ---
+# Global limit in KiB/s outside of any schedule window (0 = unlimited).
+DEFAULT_LIMIT_KIB = int(os.getenv('BANDWIDTH_LIMIT_KIB', 0))
+# JSON list of windows, e.g. [{"start": "08:00", "end": "23:00", "limit_kib": 2048}]
+DEFAULT_SCHEDULE = os.getenv('BANDWIDTH_SCHEDULE', '[]')
+# Achieved rates are averaged over this many seconds.
+RATE_WINDOW_SECONDS = 5
+
+class TokenBucket:
+    """
+    A thread-safe token bucket measured in bytes. Callers reserve tokens and sleep for
+    the returned delay, so chunks larger than the bucket are still shaped correctly.
+    """
+
+    def __init__(self, rate=None, burst_seconds=1.0):
+        self.burst_seconds = burst_seconds
+        self._lock = threading.Lock()
+        self.rate = None
+        self.capacity = 0
+        self.tokens = 0
+        self.updated_at = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        """Changes the rate in bytes per second; None or 0 disables the limit."""
+        with self._lock:
+            self.rate = rate or None
+            self.capacity = rate * self.burst_seconds if rate else 0
+            self.tokens = min(self.tokens, self.capacity)
+            self.updated_at = time.monotonic()
+
+    def reserve(self, nbytes):
+        """Takes `nbytes` tokens and returns how many seconds the caller must wait before sending them."""
+        with self._lock:
+            if not self.rate:
+                return 0
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= nbytes
+            return max(0, -self.tokens / self.rate)
+
+class RateMeter:
+    """Measures the achieved throughput over a sliding window."""
+
+    def __init__(self, window=RATE_WINDOW_SECONDS):
+        self.window = window
+        self._samples = deque()
+        self._lock = threading.Lock()
+
+    def add(self, nbytes):
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, nbytes))
+            self._prune(now)
+
+    def _prune(self, now):
+        while self._samples and now - self._samples[0][0] > self.window:
+            self._samples.popleft()
+
+    def rate(self):
+        with self._lock:
+            self._prune(time.monotonic())
+            return sum(nbytes for _, nbytes in self._samples) / self.window
+
+def _parse_time(value):
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+class BandwidthLimiter:
+    """
+    Shapes download throughput with a global token bucket and optional per-job buckets.
+    The global limit follows time-of-day schedule windows and can be reconfigured live.
+    """
+
+    def __init__(self, default_limit_kib=DEFAULT_LIMIT_KIB):
+        self._lock = threading.Lock()
+        self.default_limit_kib = default_limit_kib
+        self.schedule = []
+        self.job_limits_kib = {}
+        self._global_bucket = TokenBucket()
+        self._global_meter = RateMeter()
+        self._job_buckets = {}
+        self._job_meters = {}
+
+    def configure(self, default_limit_kib=None, schedule=None, job_limits_kib=None):
+        """Updates the limits. Arguments left as None are unchanged."""
+        with self._lock:
+            if default_limit_kib is not None:
+                self.default_limit_kib = int(default_limit_kib)
+            if schedule is not None:
+                for window in schedule:
+                    _parse_time(window['start'])
+                    _parse_time(window['end'])
+                    int(window['limit_kib'])
+                self.schedule = schedule
+            if job_limits_kib is not None:
+                for job_id, limit_kib in job_limits_kib.items():
+                    job_id = int(job_id)
+                    if limit_kib:
+                        self.job_limits_kib[job_id] = int(limit_kib)
+                        self._job_buckets.setdefault(job_id, TokenBucket()).set_rate(int(limit_kib) * 1024)
+                    else:
+                        self.job_limits_kib.pop(job_id, None)
+                        self._job_buckets.pop(job_id, None)
+        log.info(f"Bandwidth limits updated: default={self.default_limit_kib} KiB/s, {len(self.schedule)} schedule window(s), {len(self.job_limits_kib)} job limit(s).")
+
+    def current_limit_kib(self):
+        """Returns the global limit in effect right now, in KiB/s (0 = unlimited)."""
+        now = datetime.now()
+        minute_of_day = now.hour * 60 + now.minute
+        for window in self.schedule:
+            start, end = _parse_time(window['start']), _parse_time(window['end'])
+            # Windows where start > end wrap around midnight.
+            in_window = start <= minute_of_day < end if start <= end else (minute_of_day >= start or minute_of_day < end)
+            if in_window:
+                return int(window['limit_kib'])
+        return self.default_limit_kib
+
+    def throttle(self, job_id, nbytes, cancellation_check=None):
+        """Accounts for `nbytes` received by a job and sleeps as long as needed to respect the limits."""
+        target = self.current_limit_kib() * 1024 or None
+        if target != self._global_bucket.rate:
+            self._global_bucket.set_rate(target)
+
+        delay = self._global_bucket.reserve(nbytes)
+        with self._lock:
+            job_bucket = self._job_buckets.get(job_id)
+            job_meter = self._job_meters.setdefault(job_id, RateMeter())
+        if job_bucket:
+            delay = max(delay, job_bucket.reserve(nbytes))
+
+        self._global_meter.add(nbytes)
+        job_meter.add(nbytes)
+
+        if delay > 0:
+            if hasattr(cancellation_check, 'wait'):
+                cancellation_check.wait(delay)
+            else:
+                time.sleep(delay)
+
+    def release(self, job_id):
+        """Forgets the meter of a job that left its worker. Its configured limit stays for when it comes back."""
+        with self._lock:
+            self._job_meters.pop(job_id, None)
+
+    def forget(self, job_id):
+        """Drops the configured limit of a job that completed, failed for good or was deleted."""
+        with self._lock:
+            self._job_buckets.pop(job_id, None)
+            self.job_limits_kib.pop(job_id, None)
+
+    def stats(self):
+        with self._lock:
+            job_meters = dict(self._job_meters)
+            job_limits = dict(self.job_limits_kib)
+        return {
+            'default_limit_kib': self.default_limit_kib,
+            'schedule': self.schedule,
+            'target_kib': self.current_limit_kib(),
+            'achieved_kib': round(self._global_meter.rate() / 1024, 1),
+            'jobs': {
+                job_id: {
+                    'target_kib': job_limits.get(job_id, 0),
+                    'achieved_kib': round(meter.rate() / 1024, 1),
+                }
+                for job_id, meter in job_meters.items()
+            },
+        }
+
+bandwidth_limiter = BandwidthLimiter()
+try:
+    bandwidth_limiter.configure(schedule=json.loads(DEFAULT_SCHEDULE))
+except (ValueError, KeyError, TypeError, AttributeError) as e:
+    log.error(f"Invalid BANDWIDTH_SCHEDULE, ignoring it: {e}")
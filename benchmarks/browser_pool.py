@@ -0,0 +1,89 @@
+"""
+Time until #dlw is available on a saved 1fichier page, full vs. lean page mode.
+Every host is mapped to a local server that answers subresources with fixed latency,
+so both modes see the same "network". Needs Chrome and chromedriver.
+
+Run from the repository root: python -m benchmarks.browser_pool [runs] [asset_latency_seconds]
+"""
+import os
+import sys
+import time
+import threading
+import statistics
+import http.server
+import socketserver
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+
+from browser_pool import build_chrome_options, apply_request_blocking
+
+def main(runs=10, asset_latency=0.15):
+    fixture_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fixtures', '1fichier_free_download.html')
+    with open(fixture_path, 'rb') as f:
+        fixture = f.read()
+
+    # 1x1 transparent GIF
+    pixel = b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+
+    class FixtureHandler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.startswith('/?'):
+                body, content_type = fixture, 'text/html; charset=utf-8'
+            else:
+                time.sleep(asset_latency)
+                path = self.path.split('?')[0]
+                if path.endswith('.js'):
+                    # Third-party scripts also cost CPU time on the main thread.
+                    body, content_type = b'var t = Date.now(); while (Date.now() - t < 30) {}', 'application/javascript'
+                elif path.endswith('.css') or path == '/css':
+                    body, content_type = b'@font-face { font-family: "Open Sans"; src: url(http://fonts.gstatic.com/s/opensans.woff2); }', 'text/css'
+                else:
+                    body, content_type = pixel, 'image/gif'
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            self.wfile.write(body)
+
+    class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = {}
+    for lean in (False, True):
+        options = build_chrome_options(lean)
+        options.add_argument(f"--host-resolver-rules=MAP * 127.0.0.1:{server.server_port}")
+        driver = webdriver.Chrome(options=options)
+        if lean:
+            apply_request_blocking(driver)
+        driver.execute_cdp_cmd('Network.setCacheDisabled', {'cacheDisabled': True})
+        timings = []
+        try:
+            for _ in range(runs):
+                start = time.perf_counter()
+                driver.get('http://1fichier.com/?bench')
+                WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.ID, 'dlw')))
+                timings.append(time.perf_counter() - start)
+        finally:
+            driver.quit()
+        results['lean' if lean else 'full'] = timings
+        print(f"{'lean' if lean else 'full':>5} mode: median {statistics.median(timings) * 1000:7.1f} ms, "
+              f"min {min(timings) * 1000:7.1f} ms to #dlw ({runs} runs, {asset_latency * 1000:.0f} ms per subresource)")
+
+    speedup = statistics.median(results['full']) / statistics.median(results['lean'])
+    print(f"Lean mode reaches #dlw {speedup:.1f}x faster.")
+    server.shutdown()
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 0.15
+    )
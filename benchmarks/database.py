@@ -0,0 +1,116 @@
+"""
+Stress test against a scratch database: `writers` threads issue the writes of a busy
+instance (checkpoints, status changes, link metadata, new links) while `readers` threads
+look up single jobs. Three setups are compared: a new rollback-journal connection per
+call, per-thread WAL connections that commit their own writes, and the single writer thread.
+
+Run from the repository root: python -m benchmarks.database [seconds] [writers] [readers] [read_interval]
+"""
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import threading
+
+import database
+
+def legacy_connection(path):
+    """A new connection per call with SQLite's defaults, as before connections were reused."""
+    def connect():
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+    return connect
+
+def thread_connection(path):
+    """One WAL-mode connection per thread, like database.get_db_conn()."""
+    local = threading.local()
+    def connect():
+        if getattr(local, 'conn', None) is None:
+            local.conn = database._connect(path)
+        return local.conn
+    return connect
+
+def own_commits(connect):
+    """The calling thread runs each command on its own connection and commits it."""
+    def write(command, *args):
+        with connect() as conn:
+            return command.__wrapped__(conn.cursor(), *args)
+    return write
+
+def run(label, connect, write, duration, readers, writers, read_interval):
+    database.init_db(connect())
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO requests (title, type, status) VALUES ('Benchmark', 'tv_show', 'analyzing')")
+        cursor.executemany(
+            "INSERT INTO downloads (request_id, episode_number, status, priority) VALUES (?, ?, 'queued', ?)",
+            [(cursor.lastrowid, i, i * database.PRIORITY_GAP) for i in range(writers * 10)]
+        )
+
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    stop = time.time() + duration
+
+    def reader(worker):
+        i = 0
+        while time.time() < stop:
+            try:
+                with connect() as conn:
+                    conn.execute("SELECT * FROM downloads WHERE id = ?", (worker * 10 + i % 10 + 1,)).fetchone()
+                counts['reads'] += 1
+            except sqlite3.OperationalError:
+                counts['errors'] += 1
+            i += 1
+            # Readers poll like the web UI and the workers do; a read_interval of 0 makes them spin instead.
+            time.sleep(read_interval)
+
+    def writer(worker):
+        i = 0
+        while time.time() < stop:
+            download_id = worker * 10 + i % 10 + 1
+            try:
+                if i % 4 == 0:
+                    write(database.update_download_checkpoint, download_id, '/tmp/bench.part', i * 1048576, 1 << 30)
+                elif i % 4 == 1:
+                    write(database.update_download_status, download_id, 'downloading', i % 100)
+                elif i % 4 == 2:
+                    write(database.save_link_metadata, f"https://1fichier.com/?meta{worker}x{i}", None, i, True)
+                else:
+                    write(database.add_link_download, f"https://1fichier.com/?new{worker}x{i}", {'title': 'Benchmark'})
+                counts['writes'] += 1
+            except sqlite3.OperationalError:
+                counts['errors'] += 1
+            i += 1
+
+    threads = [threading.Thread(target=reader, args=(r,)) for r in range(readers)]
+    threads += [threading.Thread(target=writer, args=(w,)) for w in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"{label:>34}: {counts['reads'] / duration:8.0f} reads/s, {counts['writes'] / duration:7.0f} writes/s, {counts['errors']} lock errors")
+
+def main(duration=5, writers=16, readers=4, read_interval=0.001):
+    print(f"{readers} readers and {writers} writers for {duration:.0f}s each:")
+    path = os.path.join(tempfile.mkdtemp(), 'rollback.db')
+    run('connection per call, rollback', legacy_connection(path), own_commits(legacy_connection(path)),
+        duration, readers, writers, read_interval)
+
+    path = os.path.join(tempfile.mkdtemp(), 'own_commits.db')
+    connect = thread_connection(path)
+    run('per-thread WAL, own commits', connect, own_commits(connect), duration, readers, writers, read_interval)
+
+    path = os.path.join(tempfile.mkdtemp(), 'single_writer.db')
+    writer = database.DatabaseWriter(path=path)
+    run('per-thread WAL, single writer', thread_connection(path),
+        lambda command, *args: writer.run(command.__wrapped__, *args), duration, readers, writers, read_interval)
+    print(f"Writer thread: {writer.stats()}")
+
+if __name__ == '__main__':
+    main(
+        float(sys.argv[1]) if len(sys.argv) > 1 else 5,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 16,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 4,
+        float(sys.argv[4]) if len(sys.argv) > 4 else 0.001
+    )
@@ -0,0 +1,128 @@
+"""
+Serves /api/queue/stream with waitress to `viewers` local connections and reports the CPU
+the whole process used while they sat idle, while two downloads report progress 20 times
+a second, and while the same viewers poll every `poll_interval` seconds instead, the way
+the page did before, with an ETag that still matches. The viewers run in this process
+too, so the figures are an upper bound.
+
+Run from the repository root: python -m benchmarks.queue_stream [viewers] [seconds]
+"""
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import resource
+import selectors
+import tempfile
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+from waitress.server import create_server
+
+import database
+from progress_store import progress_store
+from queue_stream import QueueStream
+
+def main(viewers=300, seconds=15, poll_interval=5, jobs=200):
+    # This process only ever serves the scratch database.
+    database.DB_PATH = os.path.join(tempfile.mkdtemp(), 'load_test.db')
+    database.init_db()
+    ids = [database.add_link_download(f"https://1fichier.com/?load{i}", {'title': f"Show {i}", 'type': 'movie'}) for i in range(jobs)]
+    stream = QueueStream(max_connections=viewers)
+    stream.start()
+
+    def app(environ, start_response):
+        if environ['PATH_INFO'] == '/poll':
+            version = str(database.get_queue_version())
+            if environ.get('HTTP_IF_NONE_MATCH') == f'"{version}"':
+                start_response('304 Not Modified', [('ETag', f'"{version}"')])
+                return []
+            body = json.dumps(progress_store.overlay(database.get_all_downloads())).encode()
+            start_response('200 OK', [('Content-Type', 'application/json'), ('ETag', f'"{version}"')])
+            return [body]
+        start_response('200 OK', [('Content-Type', 'text/event-stream'), ('Cache-Control', 'no-cache')])
+        return (event.encode() for event in stream.open(database.get_queue_version()))
+
+    server = create_server(app, host='127.0.0.1', port=0, threads=viewers + 4,
+                           connection_limit=viewers + 16, asyncore_use_poll=True)
+    threading.Thread(target=server.run, name="LoadTestServer", daemon=True).start()
+    port = server.effective_port
+
+    selector = selectors.DefaultSelector()
+    received = {'events': 0}
+    for _ in range(viewers):
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(b"GET /stream HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n")
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+
+    def read_streams():
+        while True:
+            for key, _ in selector.select():
+                data = key.fileobj.recv(65536)
+                received['events'] += data.count(b'\nevent: ') + data.startswith(b'event: ')
+    threading.Thread(target=read_streams, name="LoadTestViewers", daemon=True).start()
+    while stream.stats()['connections'] < viewers:
+        time.sleep(0.1)
+
+    def cpu_seconds():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    def measure(label, work=None):
+        stop = threading.Event()
+        worker = threading.Thread(target=work, args=(stop,), daemon=True) if work else None
+        events, cpu, started = received['events'], cpu_seconds(), time.monotonic()
+        if worker:
+            worker.start()
+        time.sleep(seconds)
+        stop.set()
+        if worker:
+            worker.join()
+        elapsed = time.monotonic() - started
+        used = cpu_seconds() - cpu
+        print(f"{label}: {100 * used / elapsed:.2f}% of one core, "
+              f"{(received['events'] - events) / elapsed / viewers:.2f} event(s)/s per viewer.")
+
+    def downloads(stop):
+        progress = 0
+        while not stop.is_set():
+            progress = (progress + 1) % 100
+            for download_id in ids[:2]:
+                progress_store.update(download_id, 'downloading', progress)
+            time.sleep(0.05)
+        for download_id in ids[:2]:
+            progress_store.finish(download_id)
+
+    def polling(stop):
+        def poll():
+            connection = http.client.HTTPConnection('127.0.0.1', port)
+            connection.request('GET', '/poll', headers={'If-None-Match': f'"{database.get_queue_version()}"'})
+            connection.getresponse().read()
+            connection.close()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            while not stop.is_set():
+                for _ in range(viewers):
+                    executor.submit(poll)
+                stop.wait(poll_interval)
+
+    print(f"{viewers} stream(s) open on a queue of {jobs} job(s), {seconds} s per phase.")
+    measure("Idle streams")
+    measure("Streams, 2 downloads reporting progress", downloads)
+    for key in list(selector.get_map().values()):
+        selector.unregister(key.fileobj)
+        key.fileobj.close()
+    measure(f"Polling every {poll_interval} s, no streams", polling)
+    print(f"Stream stats: {stream.stats()}")
+    server.close()
+
+if __name__ == '__main__':
+    # Polling queues requests behind the parked stream threads on purpose; don't log each one.
+    logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 300,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 15
+    )
@@ -0,0 +1,63 @@
+"""
+Inline iter_content writes vs. the threaded TransferWriter, against a local HTTP server.
+
+Run from the repository root: python -m benchmarks.transfer_writer [size_mb]
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+import http.server
+import socketserver
+
+import requests
+
+from transfer_writer import CHUNK_SIZE, TransferWriter
+
+def main(size_mb=512):
+    payload = os.urandom(size_mb * CHUNK_SIZE)
+
+    class PayloadHandler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            view = memoryview(payload)
+            for start in range(0, len(payload), CHUNK_SIZE):
+                self.wfile.write(view[start:start + CHUNK_SIZE])
+
+    class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), PayloadHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+    target = os.path.join(tempfile.mkdtemp(), 'bench.bin')
+
+    def inline():
+        with requests.get(url, stream=True) as r, open(target, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+
+    def threaded():
+        with requests.get(url, stream=True) as r, TransferWriter(target, 0, len(payload)) as writer:
+            for _ in writer.chunks(r):
+                pass
+
+    for name, run in [('inline iter_content', inline), ('TransferWriter', threaded)]:
+        best = None
+        for _ in range(3):
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{name:>20}: {size_mb / best:8.1f} MB/s (best of 3, {size_mb} MB)")
+    os.remove(target)
+    server.shutdown()
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 512)
@@ -0,0 +1,251 @@
+import os
+import time
+import atexit
+import logging
+import threading
+import psutil
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+
+log = logging.getLogger(__name__)
+
+# --- Pool Configuration ---
+POOL_SIZE = max(1, int(os.getenv('FILENAME_BROWSERS', 2)))
+MAX_PAGES_PER_SESSION = int(os.getenv('BROWSER_MAX_PAGES', 50))
+LEASE_TIMEOUT_SECONDS = int(os.getenv('BROWSER_LEASE_TIMEOUT', 120))
+# Sessions whose process tree grows past this resident size are recycled (0 = no limit).
+MAX_RSS_BYTES = int(os.getenv('BROWSER_MAX_RSS_MB', 1024)) * 1048576
+
+# --- Lean Page Mode ---
+# Eager page loads, and no images, fonts, media, ads, trackers or consent banner.
+LEAN_MODE = os.getenv('CHROME_LEAN_MODE', 'true').lower() in ('1', 'true', 'yes')
+BLOCKED_URL_PATTERNS = [
+    # Resource types the download flow never needs
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot', '*.mp4', '*.webm',
+    # Third-party ad, tracking, font and consent domains
+    '*doubleclick.net*', '*googlesyndication.com*', '*googletagmanager.com*', '*googletagservices.com*',
+    '*google-analytics.com*', '*adservice.google.*', '*amazon-adsystem.com*', '*adnxs.com*',
+    '*criteo.*', '*taboola.com*', '*outbrain.com*', '*facebook.net*', '*hotjar.com*',
+    '*fonts.googleapis.com*', '*fonts.gstatic.com*', '*consentmanager.net*',
+]
+# Comma-separated patterns blocked on top of the defaults
+BLOCKED_URL_PATTERNS += [p.strip() for p in os.getenv('CHROME_BLOCKED_URLS', '').split(',') if p.strip()]
+
+def build_chrome_options(lean=LEAN_MODE):
+    """Returns the headless Chrome options shared by every browser session."""
+    options = Options()
+    options.add_argument("--headless=new")
+    options.add_argument("--window-size=1920,1080")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    if lean:
+        # Hand the page back at DOMContentLoaded instead of waiting for every subresource.
+        options.page_load_strategy = 'eager'
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+    return options
+
+def apply_request_blocking(driver, patterns=None):
+    """Blocks non-essential requests in a Chrome session through the DevTools protocol."""
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': patterns or BLOCKED_URL_PATTERNS})
+    except Exception as e:
+        log.warning(f"Could not enable request blocking, pages will load in full: {e}")
+
+def start_chrome(lean=LEAN_MODE):
+    """Starts a headless Chrome session, in lean page mode unless disabled."""
+    driver = webdriver.Chrome(options=build_chrome_options(lean))
+    if lean:
+        apply_request_blocking(driver)
+    return driver
+
+def browser_rss_bytes(driver):
+    """Resident memory of a session's chromedriver and every Chrome process under it, in bytes, or None."""
+    try:
+        root = psutil.Process(driver.service.process.pid)
+        processes = [root] + root.children(recursive=True)
+    except (AttributeError, psutil.Error):
+        return None
+    total = 0
+    for process in processes:
+        try:
+            total += process.memory_info().rss
+        except psutil.Error:
+            # Renderers come and go while we walk the tree.
+            pass
+    return total
+
+def recycle_reason(driver, pages, max_pages=MAX_PAGES_PER_SESSION, max_rss=MAX_RSS_BYTES):
+    """Returns why a session should be restarted ('pages' or 'memory'), or None if it can keep going."""
+    if max_pages and pages >= max_pages:
+        return 'pages'
+    if max_rss:
+        rss = browser_rss_bytes(driver)
+        if rss is not None and rss >= max_rss:
+            return 'memory'
+    return None
+
+class PooledSession:
+    """A long-lived browser session and the bookkeeping needed to recycle it."""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+        self.leased_at = None
+
+class BrowserPool:
+    """
+    A bounded, thread-safe pool of warm headless Chrome sessions.
+
+    Sessions are health-checked when leased, recycled after `max_pages` pages or once
+    their processes use more than `max_rss` bytes, and reclaimed if a lease is held
+    longer than `lease_timeout` seconds.
+    """
+
+    def __init__(self, max_size=POOL_SIZE, max_pages=MAX_PAGES_PER_SESSION, lease_timeout=LEASE_TIMEOUT_SECONDS, max_rss=MAX_RSS_BYTES):
+        self.max_size = max_size
+        self.max_pages = max_pages
+        self.max_rss = max_rss
+        self.lease_timeout = lease_timeout
+        self.recycled = {'pages': 0, 'memory': 0}
+        self._idle = []
+        self._leased = {}
+        self._starting = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def _create_session(self):
+        log.info("Starting a new pooled browser session...")
+        return PooledSession(start_chrome())
+
+    @staticmethod
+    def _discard(session):
+        try:
+            session.driver.quit()
+        except Exception as e:
+            log.warning(f"Failed to quit pooled browser session cleanly: {e}")
+
+    @staticmethod
+    def _is_healthy(session):
+        try:
+            session.driver.execute_script("return 1")
+            return True
+        except Exception:
+            return False
+
+    def _pop_expired_leases(self):
+        """Removes leases held past the timeout. Must be called with the condition held."""
+        now = time.time()
+        expired = [s for s in self._leased.values() if now - s.leased_at > self.lease_timeout]
+        for session in expired:
+            log.warning(f"Browser lease exceeded {self.lease_timeout}s, reclaiming the session.")
+            del self._leased[id(session)]
+        return expired
+
+    def acquire(self, timeout=None):
+        """Leases a session, waiting up to `timeout` seconds (defaults to the lease timeout) for one to free up."""
+        deadline = time.time() + (timeout if timeout is not None else self.lease_timeout)
+        session = None
+        expired = []
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Browser pool is closed.")
+                expired += self._pop_expired_leases()
+                if self._idle:
+                    session = self._idle.pop()
+                    break
+                if len(self._leased) + self._starting < self.max_size:
+                    self._starting += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise TimeoutError("No browser session became available in time.")
+                self._condition.wait(min(remaining, 1))
+
+        for stale in expired:
+            self._discard(stale)
+
+        if session is None:
+            try:
+                session = self._create_session()
+            finally:
+                with self._condition:
+                    self._starting -= 1
+                    self._condition.notify()
+        elif not self._is_healthy(session):
+            log.warning("Pooled browser session failed its health check, replacing it.")
+            self._discard(session)
+            session = self._create_session()
+
+        with self._condition:
+            session.leased_at = time.time()
+            self._leased[id(session)] = session
+        return session
+
+    def release(self, session):
+        # Walking the process tree takes a moment, so the watermarks are checked outside the lock.
+        reason = recycle_reason(session.driver, session.pages + 1, self.max_pages, self.max_rss)
+        with self._condition:
+            if self._leased.pop(id(session), None) is None:
+                # The lease expired and the session was already reclaimed.
+                return
+            session.pages += 1
+            recycle = self._closed or reason is not None
+            if reason:
+                self.recycled[reason] += 1
+            if not recycle:
+                session.leased_at = None
+                self._idle.append(session)
+            self._condition.notify()
+
+        if recycle:
+            log.info(f"Recycling browser session after {session.pages} pages" + (f" ({reason} watermark reached)." if reason else "."))
+            self._discard(session)
+
+    @contextmanager
+    def session(self, timeout=None):
+        """Context manager yielding a leased `PooledSession`."""
+        session = self.acquire(timeout)
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    def stats(self):
+        with self._condition:
+            sessions = self._idle + list(self._leased.values())
+            stats = {
+                'max_size': self.max_size,
+                'idle': len(self._idle),
+                'leased': len(self._leased),
+                'starting': self._starting,
+                'recycled': dict(self.recycled),
+            }
+        stats['rss_bytes'] = sum(browser_rss_bytes(session.driver) or 0 for session in sessions)
+        return stats
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            sessions = self._idle + list(self._leased.values())
+            self._idle = []
+            self._leased = {}
+            self._condition.notify_all()
+        for session in sessions:
+            self._discard(session)
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+def get_shared_pool():
+    """Returns the process-wide pool used for filename lookups, creating it on first use."""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = BrowserPool()
+            atexit.register(_shared_pool.close)
+        return _shared_pool
@@ -0,0 +1,71 @@
+import time
+import logging
+import threading
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+class CancellationToken:
+    """
+    Signals that a download should stop. Calling the token returns True once it is
+    cancelled, so it can be passed anywhere a `cancellation_check` callable is expected.
+    """
+
+    def __init__(self, download_id):
+        self.download_id = download_id
+        self.requested_at = None
+        self._event = threading.Event()
+
+    def __call__(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        if not self._event.is_set():
+            self.requested_at = time.time()
+            self._event.set()
+
+    def wait(self, timeout=None):
+        """Sleeps up to `timeout` seconds, returning True as soon as the token is cancelled."""
+        return self._event.wait(timeout)
+
+class CancellationRegistry:
+    """Tokens of the jobs currently owned by a worker, keyed by download id."""
+
+    def __init__(self, history_size=100):
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=history_size)
+
+    def register(self, download_id):
+        with self._lock:
+            token = self._tokens[download_id] = CancellationToken(download_id)
+            return token
+
+    def release(self, download_id):
+        """Forgets a job's token, recording how long the worker took to stop if it was cancelled."""
+        with self._lock:
+            token = self._tokens.pop(download_id, None)
+        if token and token.requested_at:
+            latency = time.time() - token.requested_at
+            self._latencies.append(latency)
+            log.info(f"[Job {download_id}]: Cancellation took effect after {latency * 1000:.0f} ms.")
+
+    def cancel(self, download_id):
+        """Cancels an active job. Returns False if no worker currently owns it."""
+        with self._lock:
+            token = self._tokens.get(download_id)
+        if not token:
+            return False
+        token.cancel()
+        return True
+
+    def stats(self):
+        latencies = list(self._latencies)
+        return {
+            'active_tokens': len(self._tokens),
+            'samples': len(latencies),
+            'avg_latency_ms': round(sum(latencies) / len(latencies) * 1000, 1) if latencies else None,
+            'max_latency_ms': round(max(latencies) * 1000, 1) if latencies else None,
+        }
+
+cancellations = CancellationRegistry()
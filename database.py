@@ -1,18 +1,362 @@
 import sqlite3
+import asyncio
 import logging
+import threading
+import queue
+import functools
 import time
+import json
+import re
+from concurrent.futures import Future
 
 log = logging.getLogger(__name__)
 DB_PATH = 'harvester.db'
+# How long a statement waits for another connection's write lock before failing.
+BUSY_TIMEOUT_MS = 5000
+# Page cache per connection, in KiB.
+CACHE_SIZE_KIB = 8192
+# Most write commands committed together by the writer thread.
+WRITE_BATCH_SIZE = 256
+# Jobs in these states are done and move to the archive once they are old enough.
+FINISHED_STATUSES = ('completed', 'failed', 'dead')
 
-def get_db_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+_local = threading.local()
+
+def _connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=BUSY_TIMEOUT_MS / 1000)
     conn.row_factory = sqlite3.Row
+    # WAL lets readers run while a writer commits; NORMAL only syncs at checkpoints, which WAL makes safe.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
     return conn
 
-def init_db():
-    log.info(f"Initializing database at '{DB_PATH}'...")
-    with get_db_conn() as conn:
+def get_db_conn():
+    """
+    Returns the calling thread's connection, opening it on first use.
+    `with get_db_conn() as conn:` commits or rolls back on exit but keeps the connection open.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.path != DB_PATH:
+        conn = _local.conn = _connect(DB_PATH)
+        _local.path = DB_PATH
+    return conn
+
+# --- Single Writer ---
+
+class DatabaseWriter:
+    """
+    Runs every write on one thread with its own connection.
+
+    Callers queue a command and get a Future. The thread takes whatever has queued up
+    (at most WRITE_BATCH_SIZE commands) and commits it as one transaction. If a command
+    fails, the batch is run again with each command in its own savepoint, so only the
+    failing one is undone and gets the exception on its Future. Commands may therefore
+    run twice and must not do anything but database work; anything else goes through
+    after_commit(), which runs it once the command's changes are committed. With a single
+    writer, the write lock is never contended.
+    """
+
+    def __init__(self, batch_size=WRITE_BATCH_SIZE, path=None):
+        self.batch_size = batch_size
+        # None follows DB_PATH.
+        self.path = path
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._conn = None
+        self._path = None
+        self._stats = {'commands': 0, 'failed': 0, 'replayed': 0, 'commits': 0, 'largest_batch': 0}
+        self._listeners = []
+        # Actions registered by the commands of the batch being run; see after_commit().
+        self._after_commit = []
+
+    def after_commit(self, action):
+        """
+        From inside a command: runs `action()` on the writer thread once the command is committed.
+        Dropped if the command is rolled back, so a replayed batch does not run it twice.
+        """
+        self._after_commit.append(action)
+
+    def add_listener(self, callback):
+        """Calls `callback()` on the writer thread after every commit. It must return quickly."""
+        self._listeners.append(callback)
+
+    def submit(self, command, *args, **kwargs):
+        """Queues `command(cursor, *args, **kwargs)` and returns a Future for its result."""
+        future = Future()
+        self._queue.put((future, command, args, kwargs))
+        self._ensure_started()
+        return future
+
+    def run(self, command, *args, **kwargs):
+        """Runs a command and waits for its batch to commit. Returns its result or raises its exception."""
+        if threading.current_thread() is self._thread:
+            # A command calling another write function: run it inside the current savepoint.
+            return command(self._conn.cursor(), *args, **kwargs)
+        return self.submit(command, *args, **kwargs).result()
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="DatabaseWriter", daemon=True)
+                self._thread.start()
+
+    def _connection(self):
+        path = self.path or DB_PATH
+        if self._conn is None or self._path != path:
+            self._conn = _connect(path)
+            # Transactions and savepoints are managed explicitly below.
+            self._conn.isolation_level = None
+            self._path = path
+        return self._conn
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Everything that queued up while the previous batch was committing goes into this one.
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit_batch(batch)
+
+    def _execute(self, batch, isolate):
+        """
+        Runs a batch in one transaction. With `isolate`, each command gets a savepoint and
+        a failure only undoes that command; without, the first failure undoes the whole
+        batch and None is returned.
+        """
+        conn = self._connection()
+        outcomes = []
+        self._after_commit = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for future, command, args, kwargs in batch:
+                if isolate:
+                    conn.execute("SAVEPOINT command")
+                registered = len(self._after_commit)
+                try:
+                    outcomes.append((future, command(conn.cursor(), *args, **kwargs), None))
+                except Exception as e:
+                    del self._after_commit[registered:]
+                    if not isolate:
+                        conn.execute("ROLLBACK")
+                        return None
+                    conn.execute("ROLLBACK TO command")
+                    outcomes.append((future, None, e))
+                if isolate:
+                    conn.execute("RELEASE command")
+            conn.execute("COMMIT")
+        except Exception:
+            self._after_commit = []
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return outcomes
+
+    def _commit_batch(self, batch):
+        batch = [item for item in batch if item[0].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            # Savepoints cost three statements per command, so only pay for them when a command fails.
+            outcomes = self._execute(batch, isolate=False)
+            if outcomes is None:
+                self._stats['replayed'] += 1
+                outcomes = self._execute(batch, isolate=True)
+        except Exception as e:
+            log.error(f"Could not commit a batch of {len(batch)} database write(s): {e}", exc_info=True)
+            outcomes = [(future, None, e) for future, *_ in batch]
+
+        self._stats['commands'] += len(outcomes)
+        self._stats['failed'] += sum(1 for _, _, error in outcomes if error is not None)
+        self._stats['commits'] += 1
+        self._stats['largest_batch'] = max(self._stats['largest_batch'], len(batch))
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        actions, self._after_commit = self._after_commit, []
+        for action in actions:
+            try:
+                action()
+            except Exception as e:
+                log.error(f"After-commit action {action!r} failed: {e}", exc_info=True)
+        for callback in self._listeners:
+            try:
+                callback()
+            except Exception as e:
+                log.error(f"Commit listener {callback!r} failed: {e}", exc_info=True)
+
+    def stats(self):
+        return dict(self._stats, pending=self._queue.qsize())
+
+writer = DatabaseWriter()
+
+def _write(command):
+    """
+    Turns `command(cursor, ...)` into a write function that runs on the writer thread.
+    Calling it waits for the commit and returns the command's result; `.submit(...)`
+    returns the Future instead, for callers that do not need to wait.
+    """
+    @functools.wraps(command)
+    def write(*args, **kwargs):
+        return writer.run(command, *args, **kwargs)
+    write.submit = functools.partial(writer.submit, command)
+    return write
+
+def _ensure_column(cursor, table, column, definition):
+    """Adds a column to an existing table if an older database is missing it."""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [row['name'] for row in cursor.fetchall()]:
+        log.info(f"Adding missing column '{column}' to table '{table}'.")
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+# --- Schema Migrations ---
+
+def _add_hot_path_indexes(cursor):
+    """Indexes for the queue scans, the request joins and the duplicate-file lookup."""
+    # Claiming, the pending list and the waiting-links sweep filter on status and sort by priority.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_downloads_status_priority ON downloads (status, priority, id)")
+    # The cooldown check looks for parked jobs whose not_before is still in the future.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_downloads_status_not_before ON downloads (status, not_before)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_downloads_request ON downloads (request_id, episode_number)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_downloads_size_probe ON downloads (total_bytes, probe_hash)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_postprocess_tasks_status ON postprocess_tasks (status)")
+
+def _add_unique_link_key(cursor):
+    """A normalized copy of fichier_link that can be queued only once."""
+    _ensure_column(cursor, 'downloads', 'link_key', 'TEXT')
+    cursor.execute("SELECT id, fichier_link FROM downloads WHERE fichier_link IS NOT NULL ORDER BY id")
+    keys, duplicates = {}, 0
+    for row in cursor.fetchall():
+        key = normalize_link(row['fichier_link'])
+        if key in keys:
+            # Older databases may hold the same link twice; only the first job keeps the key.
+            duplicates += 1
+            continue
+        keys[key] = row['id']
+    cursor.executemany("UPDATE downloads SET link_key = ? WHERE id = ?", list(keys.items()))
+    if duplicates:
+        log.warning(f"{duplicates} download(s) repeat an earlier link and were left without a link key.")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_downloads_link_key ON downloads (link_key)")
+
+def _add_queue_order_index(cursor):
+    """An index in queue order, for appending jobs and finding a job's neighbours."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_downloads_priority ON downloads (priority, id)")
+
+def _add_archive_tables(cursor):
+    """Archive tables for finished jobs and their requests, and the finish time that decides when a job moves there."""
+    _ensure_column(cursor, 'downloads', 'finished_at', 'REAL')
+    # Jobs that finished before this migration start their retention period now.
+    cursor.execute(
+        f"UPDATE downloads SET finished_at = ? WHERE status IN ({', '.join('?' * len(FINISHED_STATUSES))}) AND finished_at IS NULL",
+        (time.time(), *FINISHED_STATUSES)
+    )
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS requests_archive (
+            id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL,
+            season INTEGER,
+            type TEXT NOT NULL,
+            status TEXT NOT NULL,
+            timestamp DATETIME,
+            archived_at REAL NOT NULL
+        )
+    ''')
+    # Same columns as downloads, plus what the history needs from the request so it never has to join.
+    cursor.execute("PRAGMA table_info(downloads)")
+    columns = [
+        'id INTEGER PRIMARY KEY' if row['name'] == 'id' else f"{row['name']} {row['type']}"
+        for row in cursor.fetchall()
+    ]
+    columns += ['title TEXT', 'request_type TEXT', 'season INTEGER', 'archived_at REAL NOT NULL']
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS downloads_archive ({', '.join(columns)})")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_downloads_archive_archived_at ON downloads_archive (archived_at, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_downloads_archive_size_probe ON downloads_archive (total_bytes, probe_hash)")
+
+def _add_queue_change_tracking(cursor):
+    """A change counter stamped on every modified job, and tombstones for deleted ones, so pollers can fetch only what changed."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS queue_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL,
+            pruned_through INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO queue_version (id, version) VALUES (1, 1)")
+    _ensure_column(cursor, 'downloads', 'change_version', 'INTEGER DEFAULT 0')
+    # Every existing job counts as changed at version 1, so ?since=0 returns all of them.
+    cursor.execute("UPDATE downloads SET change_version = 1")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_downloads_change_version ON downloads (change_version)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS deleted_downloads (
+            download_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL,
+            deleted_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_deleted_downloads_version ON deleted_downloads (version)")
+    # Triggers keep the counter in step with every write, whichever function makes it.
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS downloads_inserted AFTER INSERT ON downloads
+        BEGIN
+            UPDATE queue_version SET version = version + 1;
+            UPDATE downloads SET change_version = (SELECT version FROM queue_version) WHERE id = NEW.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS downloads_updated AFTER UPDATE ON downloads
+        WHEN NEW.change_version IS OLD.change_version
+        BEGIN
+            UPDATE queue_version SET version = version + 1;
+            UPDATE downloads SET change_version = (SELECT version FROM queue_version) WHERE id = NEW.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS downloads_deleted AFTER DELETE ON downloads
+        BEGIN
+            UPDATE queue_version SET version = version + 1;
+            INSERT OR REPLACE INTO deleted_downloads (download_id, version, deleted_at)
+            VALUES (OLD.id, (SELECT version FROM queue_version), CAST(strftime('%s', 'now') AS REAL));
+        END
+    ''')
+
+# Each migration upgrades the schema by one version. PRAGMA user_version records how many
+# have been applied, so only new ones run on startup. Append to this list, never reorder it.
+MIGRATIONS = [
+    _add_hot_path_indexes,
+    _add_unique_link_key,
+    _add_queue_order_index,
+    _add_archive_tables,
+    _add_queue_change_tracking,
+]
+
+def _apply_migrations(conn):
+    cursor = conn.cursor()
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        log.info(f"Migrating database to schema version {number}: {migration.__doc__}")
+        # One transaction per migration, so a failed one leaves the previous version intact.
+        cursor.execute("BEGIN")
+        try:
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def init_db(conn=None):
+    """Creates the tables and applies pending migrations, on `conn` if given, on the database at DB_PATH otherwise."""
+    if conn is None:
+        log.info(f"Initializing database at '{DB_PATH}'...")
+        conn = get_db_conn()
+    with conn:
         cursor = conn.cursor()
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS requests (
@@ -37,62 +381,191 @@ def init_db():
                 download_progress REAL DEFAULT 0,
                 retries INTEGER DEFAULT 0,
                 priority REAL DEFAULT 0,
+                worker TEXT,
+                part_path TEXT,
+                bytes_downloaded INTEGER DEFAULT 0,
+                total_bytes INTEGER,
+                resolver TEXT,
+                not_before REAL,
+                deferrals INTEGER DEFAULT 0,
+                file_path TEXT,
+                content_hash TEXT,
+                probe_hash TEXT,
                 FOREIGN KEY (request_id) REFERENCES requests (id)
             )
         ''')
+        _ensure_column(cursor, 'downloads', 'worker', 'TEXT')
+        _ensure_column(cursor, 'downloads', 'part_path', 'TEXT')
+        _ensure_column(cursor, 'downloads', 'bytes_downloaded', 'INTEGER DEFAULT 0')
+        _ensure_column(cursor, 'downloads', 'total_bytes', 'INTEGER')
+        _ensure_column(cursor, 'downloads', 'resolver', 'TEXT')
+        _ensure_column(cursor, 'downloads', 'not_before', 'REAL')
+        _ensure_column(cursor, 'downloads', 'deferrals', 'INTEGER DEFAULT 0')
+        _ensure_column(cursor, 'downloads', 'file_path', 'TEXT')
+        _ensure_column(cursor, 'downloads', 'content_hash', 'TEXT')
+        _ensure_column(cursor, 'downloads', 'probe_hash', 'TEXT')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS link_metadata (
+                link_key TEXT PRIMARY KEY,
+                filename TEXT,
+                size INTEGER,
+                alive INTEGER,
+                media_info TEXT,
+                updated_at REAL NOT NULL,
+                checked_at REAL
+            )
+        ''')
+        _ensure_column(cursor, 'link_metadata', 'checked_at', 'REAL')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS postprocess_tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                download_id INTEGER NOT NULL,
+                file_path TEXT NOT NULL,
+                filename TEXT,
+                owned INTEGER DEFAULT 1,
+                deduplicated INTEGER DEFAULT 0,
+                status TEXT NOT NULL,
+                step TEXT,
+                attempts INTEGER DEFAULT 0,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
         conn.commit()
+        _apply_migrations(conn)
     log.info("Database initialized successfully.")
 
-def add_request(title, media_type, season=None):
-    with get_db_conn() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO requests (title, season, type, status) VALUES (?, ?, ?, ?)",
-            (title, season, media_type, 'analyzing')
-        )
-        conn.commit()
-        return cursor.lastrowid
+@_write
+def add_request(cursor, title, media_type, season=None):
+    cursor.execute(
+        "INSERT INTO requests (title, season, type, status) VALUES (?, ?, ?, ?)",
+        (title, season, media_type, 'analyzing')
+    )
+    return cursor.lastrowid
 
-def update_request_status(request_id, status):
-    with get_db_conn() as conn:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE requests SET status = ? WHERE id = ?", (status, request_id))
-        conn.commit()
+@_write
+def update_request_status(cursor, request_id, status):
+    cursor.execute("UPDATE requests SET status = ? WHERE id = ?", (status, request_id))
 
-def add_download_links(request_id, media_data):
-    with get_db_conn() as conn:
-        cursor = conn.cursor()
-        current_time = time.time()
-        if media_data.get('episode_data'):
-            for episode in media_data['episode_data']:
-                cursor.execute(
-                    "INSERT INTO downloads (request_id, episode_number, quality, language, dl_protect_link, status, priority) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                    (request_id, episode['episode_number'], media_data['quality'], media_data['language'], episode['dl_protect_link'], 'pending_captcha', current_time)
-                )
-        else:
+@_write
+def add_download_links(cursor, request_id, media_data):
+    if media_data.get('episode_data'):
+        for episode in media_data['episode_data']:
             cursor.execute(
-                "INSERT INTO downloads (request_id, quality, language, dl_protect_link, status, priority) VALUES (?, ?, ?, ?, ?, ?)",
-                (request_id, media_data['quality'], media_data['language'], media_data['dl_protect_link'], 'pending_captcha', current_time)
+                f"INSERT INTO downloads (request_id, episode_number, quality, language, dl_protect_link, status, priority) VALUES (?, ?, ?, ?, ?, ?, {_NEXT_PRIORITY})",
+                (request_id, episode['episode_number'], media_data['quality'], media_data['language'], episode['dl_protect_link'], 'pending_captcha')
             )
-        conn.commit()
+    else:
+        cursor.execute(
+            f"INSERT INTO downloads (request_id, quality, language, dl_protect_link, status, priority) VALUES (?, ?, ?, ?, ?, {_NEXT_PRIORITY})",
+            (request_id, media_data['quality'], media_data['language'], media_data['dl_protect_link'], 'pending_captcha')
+        )
+
+@_write
+def add_link_download(cursor, link, media_info):
+    """
+    Queues a 1fichier link as a new request with a single download, at the end of the queue.
+    Returns the download id, or None if the link is already in the database in any spelling.
+    """
+    cursor.execute(
+        "INSERT INTO requests (title, season, type, status) VALUES (?, ?, ?, ?)",
+        (media_info.get('title', 'Unknown Title'), media_info.get('season'), media_info.get('type', 'unknown'), 'analyzing')
+    )
+    request_id = cursor.lastrowid
+    cursor.execute(
+        f"""INSERT INTO downloads (request_id, episode_number, quality, language, fichier_link, link_key, status, priority)
+            VALUES (?, ?, ?, ?, ?, ?, ?, {_NEXT_PRIORITY})
+            ON CONFLICT(link_key) DO NOTHING""",
+        (
+            request_id,
+            media_info.get('episode'),
+            media_info.get('quality'),
+            media_info.get('language'),
+            link,
+            normalize_link(link),
+            'queued'
+        )
+    )
+    if cursor.rowcount == 0:
+        # A duplicate is an expected outcome, so undo the request here rather than failing the writer's batch.
+        cursor.execute("DELETE FROM requests WHERE id = ?", (request_id,))
+        return None
+    return cursor.lastrowid
+
+async def add_link_download_async(link, media_info):
+    """
+    add_link_download for coroutines: awaits the writer thread's commit instead of blocking
+    the event loop on it. Returns None for a link that is already queued.
+    """
+    return await asyncio.wrap_future(add_link_download.submit(link, media_info))
+
+@_write
+def update_download_with_fichier_link(cursor, download_id, fichier_link):
+    cursor.execute(
+        "UPDATE downloads SET fichier_link = ?, link_key = ?, status = ? WHERE id = ?",
+        (fichier_link, normalize_link(fichier_link), 'queued', download_id)
+    )
+
+@_write
+def update_download_status(cursor, download_id, status, progress=None):
+    finished_at = time.time() if status in FINISHED_STATUSES else None
+    if progress is not None:
+        cursor.execute("UPDATE downloads SET status = ?, download_progress = ?, finished_at = ? WHERE id = ?", (status, progress, finished_at, download_id))
+    else:
+        cursor.execute("UPDATE downloads SET status = ?, finished_at = ? WHERE id = ?", (status, finished_at, download_id))
+
+@_write
+def update_download_progress_batch(cursor, progress_updates):
+    """Writes many (progress, download_id) pairs in a single transaction."""
+    cursor.executemany("UPDATE downloads SET download_progress = ? WHERE id = ?", progress_updates)
+
+@_write
+def update_download_checkpoint(cursor, download_id, part_path, bytes_downloaded, total_bytes=None):
+    """Records how far the transfer into the .part file has progressed, so it can be resumed."""
+    cursor.execute(
+        "UPDATE downloads SET part_path = ?, bytes_downloaded = ?, total_bytes = ? WHERE id = ?",
+        (part_path, bytes_downloaded, total_bytes, download_id)
+    )
 
-def update_download_with_fichier_link(download_id, fichier_link):
+@_write
+def update_download_file(cursor, download_id, file_path, total_bytes, probe_hash, content_hash):
+    """Records where a finished download lives and the hashes of its content."""
+    cursor.execute(
+        "UPDATE downloads SET file_path = ?, total_bytes = ?, probe_hash = ?, content_hash = ? WHERE id = ?",
+        (file_path, total_bytes, probe_hash, content_hash, download_id)
+    )
+
+@_write
+def update_download_file_path(cursor, download_id, file_path):
+    cursor.execute("UPDATE downloads SET file_path = ? WHERE id = ?", (file_path, download_id))
+
+def find_completed_files(total_bytes, probe_hash):
+    """Returns the paths of completed downloads (archived ones included) with the given size and probe hash."""
     with get_db_conn() as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE downloads SET fichier_link = ?, status = ? WHERE id = ?",
-            (fichier_link, 'queued', download_id)
-        )
-        conn.commit()
+        cursor.execute("""
+            SELECT file_path FROM downloads WHERE status = 'completed' AND file_path IS NOT NULL AND total_bytes = ? AND probe_hash = ?
+            UNION
+            SELECT file_path FROM downloads_archive WHERE status = 'completed' AND file_path IS NOT NULL AND total_bytes = ? AND probe_hash = ?
+        """, (total_bytes, probe_hash, total_bytes, probe_hash))
+        return [row['file_path'] for row in cursor.fetchall()]
+
+@_write
+def update_download_resolver(cursor, download_id, resolver):
+    cursor.execute("UPDATE downloads SET resolver = ? WHERE id = ?", (resolver, download_id))
 
-def update_download_status(download_id, status, progress=None):
+def get_resolver_stats():
+    """Counts the jobs resolved by each resolver path ('http' or 'browser')."""
     with get_db_conn() as conn:
         cursor = conn.cursor()
-        if progress is not None:
-            cursor.execute("UPDATE downloads SET status = ?, download_progress = ? WHERE id = ?", (status, progress, download_id))
-        else:
-            cursor.execute("UPDATE downloads SET status = ? WHERE id = ?", (status, download_id))
-        conn.commit()
+        cursor.execute("""
+            SELECT resolver, COUNT(*) AS count
+            FROM (SELECT resolver FROM downloads UNION ALL SELECT resolver FROM downloads_archive)
+            WHERE resolver IS NOT NULL
+            GROUP BY resolver
+        """)
+        return {row['resolver']: row['count'] for row in cursor.fetchall()}
 
 def get_request_status(request_id):
     with get_db_conn() as conn:
@@ -175,45 +648,454 @@ def get_pending_downloads():
         downloads = [dict(row) for row in cursor.fetchall()]
         return downloads
 
-def reset_stale_downloads():
+@_write
+def claim_next_download(cursor, worker_name):
+    """
+    Claims the next download for a worker: a parked job whose cooldown has ended
+    first, otherwise the highest-priority queued one. Claims run on the writer
+    thread one at a time, so two workers can never claim the same row.
+    Returns None while a cooldown is running, since 1fichier enforces it per IP.
+    """
+    now = time.time()
+    cursor.execute(
+        "SELECT 1 FROM downloads WHERE status = 'pending' AND not_before > ? LIMIT 1",
+        (now,)
+    )
+    if cursor.fetchone():
+        return None
+
+    cursor.execute("""
+        SELECT d.*, r.title
+        FROM downloads d
+        JOIN requests r ON d.request_id = r.id
+        WHERE d.status = 'queued'
+           OR (d.status IN ('pending', 'waiting_space') AND d.not_before IS NOT NULL AND d.not_before <= ?)
+        ORDER BY d.not_before IS NULL, d.priority ASC, d.id ASC
+        LIMIT 1
+    """, (now,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+
+    cursor.execute(
+        "UPDATE downloads SET status = 'processing', worker = ?, not_before = NULL WHERE id = ?",
+        (worker_name, row['id'])
+    )
+    job = dict(row)
+    job['status'] = 'processing'
+    job['worker'] = worker_name
+    job['not_before'] = None
+    return job
+
+@_write
+def park_download(cursor, download_id, not_before):
+    """
+    Parks a job until `not_before` (a UNIX timestamp) because of a 1fichier cooldown.
+    Returns the job's new deferral count, or None if it no longer exists.
+    """
+    cursor.execute(
+        "UPDATE downloads SET status = 'pending', not_before = ?, worker = NULL, deferrals = deferrals + 1 WHERE id = ?",
+        (not_before, download_id)
+    )
+    cursor.execute("SELECT deferrals FROM downloads WHERE id = ?", (download_id,))
+    row = cursor.fetchone()
+    return row['deferrals'] if row else None
+
+@_write
+def defer_download_for_space(cursor, download_id, not_before):
+    """
+    Puts a job back in the queue until `not_before` because the download disk is too full.
+    Unlike a cooldown, this does not hold back the other jobs.
+    """
+    cursor.execute(
+        "UPDATE downloads SET status = 'waiting_space', not_before = ?, worker = NULL WHERE id = ?",
+        (not_before, download_id)
+    )
+
+def get_cooldown_until():
+    """Returns when the running cooldown ends (UNIX timestamp), or None if there is none."""
     with get_db_conn() as conn:
         cursor = conn.cursor()
-        cursor.execute("UPDATE downloads SET status = 'queued', download_progress = 0 WHERE status IN ('downloading', 'processing', 'pending')")
-        conn.commit()
-        log.info(f"{cursor.rowcount} stale downloads have been reset to 'queued'.")
+        cursor.execute(
+            "SELECT MAX(not_before) AS until FROM downloads WHERE status = 'pending' AND not_before > ?",
+            (time.time(),)
+        )
+        return cursor.fetchone()['until']
+
+def get_waiting_links():
+    """Returns the 1fichier links of jobs that are queued or parked."""
+    with get_db_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT fichier_link FROM downloads WHERE status IN ('queued', 'pending', 'waiting_space') AND fichier_link IS NOT NULL ORDER BY priority ASC, id ASC")
+        return [row['fichier_link'] for row in cursor.fetchall()]
+
+@_write
+def mark_links_dead(cursor, links):
+    """Marks the waiting jobs of dead 1fichier links as 'dead'. Returns how many jobs were marked."""
+    cursor.executemany(
+        "UPDATE downloads SET status = 'dead', worker = NULL, not_before = NULL, finished_at = ? WHERE link_key = ? AND status IN ('queued', 'pending', 'waiting_space')",
+        [(time.time(), normalize_link(link)) for link in links]
+    )
+    return cursor.rowcount
+
+@_write
+def reset_stale_downloads(cursor):
+    # Keep the progress of transfers that have a .part file to resume from.
+    cursor.execute("""
+        UPDATE downloads
+        SET status = 'queued',
+            download_progress = CASE WHEN bytes_downloaded > 0 THEN download_progress ELSE 0 END
+        WHERE status IN ('downloading', 'processing')
+           OR (status = 'pending' AND not_before IS NULL)
+    """)
+    log.info(f"{cursor.rowcount} stale downloads have been reset to 'queued'.")
+
+@_write
+def update_download_priority(cursor, download_id, priority):
+    cursor.execute("UPDATE downloads SET priority = ? WHERE id = ?", (priority, download_id))
+
+@_write
+def delete_download(cursor, download_id):
+    cursor.execute("DELETE FROM downloads WHERE id = ?", (download_id,))
+
+@_write
+def increment_retry_count(cursor, download_id):
+    cursor.execute("UPDATE downloads SET retries = retries + 1 WHERE id = ?", (download_id,))
 
-def update_download_priority(download_id, priority):
+def is_link_already_added(fichier_link):
     with get_db_conn() as conn:
         cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM downloads WHERE link_key = ?", (normalize_link(fichier_link),))
+        return cursor.fetchone() is not None
+
+# --- Queue Order ---
+# Jobs run in (priority, id) order. Appended jobs get priorities PRIORITY_GAP apart, so a job is
+# moved between two others by giving it the midpoint of their priorities: only its own row changes.
+PRIORITY_GAP = 1024.0
+# Neighbours closer than this get the whole queue respaced in the background before floats run out of room.
+MIN_PRIORITY_GAP = 1e-3
+
+class QueueMoveError(Exception):
+    """Raised when a job still cannot be placed between its new neighbours after the queue was respaced."""
+    pass
+
+_NEXT_PRIORITY = f"(SELECT COALESCE(MAX(priority), 0) + {PRIORITY_GAP} FROM downloads)"
+
+def _queue_position(cursor, download_id):
+    cursor.execute("SELECT id, priority FROM downloads WHERE id = ?", (download_id,))
+    return cursor.fetchone()
+
+def _queue_neighbour(cursor, anchor, previous, exclude):
+    """The job right before (or after) `anchor` in queue order, ignoring `exclude`."""
+    if previous:
+        cursor.execute(
+            "SELECT id, priority FROM downloads WHERE (priority < ? OR (priority = ? AND id < ?)) AND id != ? ORDER BY priority DESC, id DESC LIMIT 1",
+            (anchor['priority'], anchor['priority'], anchor['id'], exclude)
+        )
+    else:
+        cursor.execute(
+            "SELECT id, priority FROM downloads WHERE (priority > ? OR (priority = ? AND id > ?)) AND id != ? ORDER BY priority ASC, id ASC LIMIT 1",
+            (anchor['priority'], anchor['priority'], anchor['id'], exclude)
+        )
+    return cursor.fetchone()
+
+def _respace_priorities(cursor):
+    cursor.execute("SELECT id FROM downloads ORDER BY priority ASC, id ASC")
+    ids = [row['id'] for row in cursor.fetchall()]
+    cursor.executemany("UPDATE downloads SET priority = ? WHERE id = ?", [((i + 1) * PRIORITY_GAP, download_id) for i, download_id in enumerate(ids)])
+    return len(ids)
+
+@_write
+def respace_priorities(cursor):
+    """Gives every job a priority PRIORITY_GAP apart from its neighbours, keeping the current order."""
+    count = _respace_priorities(cursor)
+    log.info(f"Respaced the priorities of {count} download(s).")
+
+@_write
+def move_download(cursor, download_id, before_id=None, after_id=None):
+    """
+    Moves a job right before `before_id` or right after `after_id`.
+    Returns False if either job does not exist, and raises QueueMoveError if no priority
+    could be found between the neighbours even after respacing.
+    """
+    if (before_id is None) == (after_id is None):
+        raise ValueError("Pass exactly one of before_id and after_id.")
+    anchor_id = before_id if before_id is not None else after_id
+
+    for _ in range(2):
+        anchor = _queue_position(cursor, anchor_id)
+        if not anchor or not _queue_position(cursor, download_id):
+            return False
+        neighbour = _queue_neighbour(cursor, anchor, before_id is not None, download_id)
+        if neighbour is None:
+            priority = anchor['priority'] + (-PRIORITY_GAP if before_id is not None else PRIORITY_GAP)
+        else:
+            priority = (anchor['priority'] + neighbour['priority']) / 2
+            if priority in (anchor['priority'], neighbour['priority']):
+                # Equal priorities (or no float left between them): respace now and try again.
+                _respace_priorities(cursor)
+                continue
         cursor.execute("UPDATE downloads SET priority = ? WHERE id = ?", (priority, download_id))
-        conn.commit()
+        if neighbour is not None and abs(anchor['priority'] - neighbour['priority']) / 2 < MIN_PRIORITY_GAP:
+            # Queued once this command is committed, so it runs in a later batch and does not delay this one.
+            writer.after_commit(respace_priorities.submit)
+        return True
+    raise QueueMoveError(f"No room to move job {download_id} next to job {anchor_id}.")
+
+@_write
+def move_download_to_top(cursor, download_id):
+    """Moves a job ahead of all others. Returns False if it does not exist."""
+    cursor.execute(
+        "UPDATE downloads SET priority = (SELECT MIN(priority) FROM downloads) - ? WHERE id = ?",
+        (PRIORITY_GAP, download_id)
+    )
+    return cursor.rowcount == 1
 
-def update_priorities(download_ids):
+@_write
+def move_download_to_bottom(cursor, download_id):
+    """Moves a job behind all others. Returns False if it does not exist."""
+    cursor.execute(f"UPDATE downloads SET priority = {_NEXT_PRIORITY} WHERE id = ?", (download_id,))
+    return cursor.rowcount == 1
+
+@_write
+def move_download_step(cursor, download_id, direction):
+    """Swaps a job with the one right before ('up') or after ('down') it. Returns False if it does not exist."""
+    current = _queue_position(cursor, download_id)
+    if not current:
+        return False
+    neighbour = _queue_neighbour(cursor, current, direction == 'up', download_id)
+    if neighbour is None:
+        return True
+    if direction == 'up':
+        return move_download(download_id, before_id=neighbour['id'])
+    return move_download(download_id, after_id=neighbour['id'])
+
+# --- Archive ---
+
+@_write
+def archive_finished_downloads(cursor, finished_before, limit):
+    """
+    Moves up to `limit` jobs that finished before `finished_before` (a UNIX timestamp) into
+    downloads_archive, and their requests into requests_archive once no job of theirs is left.
+    Returns how many jobs were moved.
+    """
+    cursor.execute(
+        f"SELECT id, request_id FROM downloads WHERE status IN ({', '.join('?' * len(FINISHED_STATUSES))}) AND finished_at < ? ORDER BY id LIMIT ?",
+        (*FINISHED_STATUSES, finished_before, limit)
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        return 0
+    download_ids = [row['id'] for row in rows]
+    request_ids = list({row['request_id'] for row in rows})
+    now = time.time()
+
+    # Copy the columns both tables have, so a column added to downloads later cannot break archiving.
+    cursor.execute("PRAGMA table_info(downloads_archive)")
+    archived_columns = {row['name'] for row in cursor.fetchall()}
+    cursor.execute("PRAGMA table_info(downloads)")
+    columns = [row['name'] for row in cursor.fetchall() if row['name'] in archived_columns]
+
+    download_marks = ', '.join('?' * len(download_ids))
+    cursor.execute(f"""
+        INSERT INTO downloads_archive ({', '.join(columns)}, title, request_type, season, archived_at)
+        SELECT {', '.join(f'd.{column}' for column in columns)}, r.title, r.type, r.season, ?
+        FROM downloads d
+        LEFT JOIN requests r ON d.request_id = r.id
+        WHERE d.id IN ({download_marks})
+    """, (now, *download_ids))
+    cursor.execute(f"DELETE FROM downloads WHERE id IN ({download_marks})", download_ids)
+
+    request_marks = ', '.join('?' * len(request_ids))
+    empty_requests = f"id IN ({request_marks}) AND NOT EXISTS (SELECT 1 FROM downloads d WHERE d.request_id = requests.id)"
+    cursor.execute(f"""
+        INSERT OR REPLACE INTO requests_archive (id, title, season, type, status, timestamp, archived_at)
+        SELECT id, title, season, type, status, timestamp, ? FROM requests WHERE {empty_requests}
+    """, (now, *request_ids))
+    cursor.execute(f"DELETE FROM requests WHERE {empty_requests}", request_ids)
+    return len(download_ids)
+
+def get_download_history(page=1, per_page=50, status=None):
+    """Returns one page of archived jobs, most recently archived first, and the total number of archived jobs."""
+    where, params = ("WHERE status = ?", (status,)) if status else ("", ())
     with get_db_conn() as conn:
         cursor = conn.cursor()
-        for i, download_id in enumerate(download_ids):
-            cursor.execute("UPDATE downloads SET priority = ? WHERE id = ?", (i, download_id))
-        conn.commit()
+        cursor.execute(f"SELECT COUNT(*) FROM downloads_archive {where}", params)
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            f"SELECT * FROM downloads_archive {where} ORDER BY archived_at DESC, id DESC LIMIT ? OFFSET ?",
+            (*params, per_page, (page - 1) * per_page)
+        )
+        return [dict(row) for row in cursor.fetchall()], total
+
+# --- Queue Changes ---
 
-def delete_download(download_id):
+def get_queue_version():
+    """The change counter of the queue: it grows whenever a job is added, modified or deleted."""
     with get_db_conn() as conn:
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM downloads WHERE id = ?", (download_id,))
-        conn.commit()
+        cursor.execute("SELECT version FROM queue_version")
+        return cursor.fetchone()['version']
 
-def increment_retry_count(download_id):
+def get_queue_changes(since):
+    """
+    Returns (version, changed, deleted, complete): the current version, the jobs modified after
+    version `since` (joined like get_all_downloads) and the ids deleted after it. `complete` is
+    False if tombstones older than `since` were pruned; `changed` then holds every job instead.
+    """
     with get_db_conn() as conn:
         cursor = conn.cursor()
-        cursor.execute("UPDATE downloads SET retries = retries + 1 WHERE id = ?", (download_id,))
-        conn.commit()
+        # One read transaction, so the version matches the rows returned with it.
+        cursor.execute("BEGIN")
+        try:
+            cursor.execute("SELECT version, pruned_through FROM queue_version")
+            state = cursor.fetchone()
+            complete = state['pruned_through'] <= since <= state['version']
+            cursor.execute("""
+                SELECT d.*, r.title, r.type as request_type, r.season
+                FROM downloads d
+                JOIN requests r ON d.request_id = r.id
+                WHERE d.change_version > ?
+                ORDER BY d.priority ASC, d.id ASC
+            """, (since if complete else 0,))
+            changed = [dict(row) for row in cursor.fetchall()]
+            deleted = []
+            if complete:
+                cursor.execute("SELECT download_id FROM deleted_downloads WHERE version > ?", (since,))
+                deleted = [row['download_id'] for row in cursor.fetchall()]
+        finally:
+            conn.commit()
+        return state['version'], changed, deleted, complete
 
-def is_link_already_added(fichier_link):
+@_write
+def prune_deleted_downloads(cursor, deleted_before):
+    """Forgets tombstones older than `deleted_before`. Returns how many were dropped; pollers that are further behind get a full list."""
+    cursor.execute("SELECT MAX(version) FROM deleted_downloads WHERE deleted_at < ?", (deleted_before,))
+    pruned_through = cursor.fetchone()[0]
+    if pruned_through is None:
+        return 0
+    cursor.execute("DELETE FROM deleted_downloads WHERE deleted_at < ?", (deleted_before,))
+    pruned = cursor.rowcount
+    cursor.execute("UPDATE queue_version SET pruned_through = MAX(pruned_through, ?)", (pruned_through,))
+    return pruned
+
+# --- Link Metadata Cache ---
+
+def normalize_link(link):
+    """Reduces a 1fichier URL to a canonical key, e.g. 'https://1fichier.com/?AbC&af=1' -> '1fichier.com/?abc'."""
+    link = link.strip()
+    match = re.search(r'1fichier\.com/\?([a-z0-9]+)', link, re.IGNORECASE)
+    if match:
+        return f"1fichier.com/?{match.group(1).lower()}"
+    return re.sub(r'^https?://(www\.)?', '', link).rstrip('/').lower()
+
+def get_cached_link_metadata(link, max_age_seconds):
+    """Returns the cached metadata of a link, or None if it is missing or older than `max_age_seconds`."""
     with get_db_conn() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM downloads WHERE fichier_link = ?", (fichier_link,))
-        return cursor.fetchone() is not None
+        cursor.execute(
+            "SELECT * FROM link_metadata WHERE link_key = ? AND updated_at >= ?",
+            (normalize_link(link), time.time() - max_age_seconds)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        metadata = dict(row)
+        metadata['alive'] = None if metadata['alive'] is None else bool(metadata['alive'])
+        metadata['media_info'] = json.loads(metadata['media_info']) if metadata['media_info'] else None
+        return metadata
+
+@_write
+def save_link_metadata(cursor, link, filename=None, size=None, alive=None, media_info=None):
+    """
+    Inserts or updates the cached metadata of a link. Fields left as None keep their cached value.
+    Passing `alive` also records when the link's liveness was last checked.
+    """
+    now = time.time()
+    cursor.execute("""
+        INSERT INTO link_metadata (link_key, filename, size, alive, media_info, updated_at, checked_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(link_key) DO UPDATE SET
+            filename = COALESCE(excluded.filename, filename),
+            size = COALESCE(excluded.size, size),
+            alive = COALESCE(excluded.alive, alive),
+            media_info = COALESCE(excluded.media_info, media_info),
+            updated_at = excluded.updated_at,
+            checked_at = COALESCE(excluded.checked_at, checked_at)
+    """, (
+        normalize_link(link),
+        filename,
+        size,
+        None if alive is None else int(alive),
+        json.dumps(media_info) if media_info is not None else None,
+        now,
+        now if alive is not None else None
+    ))
+
+@_write
+def evict_link_metadata(cursor, max_age_seconds, max_entries):
+    """Drops expired cache entries, then the oldest ones beyond `max_entries`."""
+    cursor.execute("DELETE FROM link_metadata WHERE updated_at < ?", (time.time() - max_age_seconds,))
+    evicted = cursor.rowcount
+    cursor.execute(
+        "DELETE FROM link_metadata WHERE link_key IN (SELECT link_key FROM link_metadata ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+        (max_entries,)
+    )
+    evicted += cursor.rowcount
+    return evicted
+
+# --- Post-processing Tasks ---
+
+@_write
+def add_postprocess_task(cursor, download_id, file_path, filename, owned=True, deduplicated=False):
+    now = time.time()
+    cursor.execute(
+        """INSERT INTO postprocess_tasks (download_id, file_path, filename, owned, deduplicated, status, created_at, updated_at)
+           VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)""",
+        (download_id, file_path, filename, int(owned), int(deduplicated), now, now)
+    )
+    return cursor.lastrowid
+
+def get_postprocess_task(task_id):
+    with get_db_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM postprocess_tasks WHERE id = ?", (task_id,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+@_write
+def start_postprocess_task(cursor, task_id):
+    """Marks a task as running and counts an attempt. Every run counts, including one resumed after a crash."""
+    cursor.execute(
+        "UPDATE postprocess_tasks SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+        (time.time(), task_id)
+    )
+
+@_write
+def update_postprocess_task(cursor, task_id, status, step=None, file_path=None, error=None):
+    """Moves a task to `status`. `step` and `file_path` are only changed when given."""
+    cursor.execute(
+        """UPDATE postprocess_tasks
+           SET status = ?, step = COALESCE(?, step), file_path = COALESCE(?, file_path), error = ?, updated_at = ?
+           WHERE id = ?""",
+        (status, step, file_path, error, time.time(), task_id)
+    )
+
+def get_unfinished_postprocess_tasks():
+    """Returns the ids of tasks that were queued or interrupted while running."""
+    with get_db_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM postprocess_tasks WHERE status IN ('queued', 'running') ORDER BY id ASC")
+        return [row['id'] for row in cursor.fetchall()]
+
+def get_postprocess_stats():
+    """Counts post-processing tasks by status."""
+    with get_db_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT status, COUNT(*) AS count FROM postprocess_tasks GROUP BY status")
+        return {row['status']: row['count'] for row in cursor.fetchall()}
 
 if __name__ == '__main__':
     import logger_setup
     logger_setup.setup_logging()
-    init_db()
\ No newline at end of file
+    init_db()
@@ -0,0 +1,90 @@
+import os
+import hashlib
+import logging
+
+import database
+
+log = logging.getLogger(__name__)
+
+# --- Deduplication Configuration ---
+# 'link' hard-links an existing copy under the new name, 'skip' just points the job at it, 'off' always downloads.
+# Any mode but 'off' probes every fresh transfer first, which costs 1fichier extra requests.
+DEDUP_MODE = os.getenv('DEDUP_MODE', 'off').lower()
+HASH_ALGORITHM = 'sha256'
+# The probe hash covers the file size and this many leading bytes.
+PROBE_BYTES = 1048576
+READ_SIZE = 1048576
+
+def new_hasher():
+    return hashlib.new(HASH_ALGORITHM)
+
+def probe_hash(head, size):
+    """Fingerprints a file from its size and first PROBE_BYTES bytes."""
+    hasher = new_hasher()
+    hasher.update(str(size).encode())
+    hasher.update(head[:PROBE_BYTES])
+    return hasher.hexdigest()
+
+def read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(length)
+
+def probe_file(path):
+    size = os.path.getsize(path)
+    return probe_hash(read_range(path, 0, PROBE_BYTES), size)
+
+def hash_file(path, limit=None, hasher=None):
+    """Feeds the first `limit` bytes of a file (all of it by default) into `hasher` and returns it."""
+    hasher = hasher or new_hasher()
+    remaining = limit
+    with open(path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(READ_SIZE if remaining is None else min(READ_SIZE, remaining))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return hasher
+
+def find_duplicate(download_dir, size, probe):
+    """
+    Looks for a local file with the given size and probe hash: completed downloads
+    first, then any file of the same size sitting in the downloads directory.
+    """
+    if not size:
+        return None
+    for path in database.find_completed_files(size, probe):
+        if os.path.isfile(path) and os.path.getsize(path) == size:
+            return path
+
+    try:
+        entries = list(os.scandir(download_dir))
+    except OSError as e:
+        log.warning(f"Could not scan {download_dir} for duplicates: {e}")
+        return None
+    for entry in entries:
+        if entry.name.endswith('.part') or not entry.is_file():
+            continue
+        try:
+            if entry.stat().st_size == size and probe_file(entry.path) == probe:
+                return entry.path
+        except OSError:
+            continue
+    return None
+
+def adopt_duplicate(existing, target):
+    """
+    Makes an existing copy available as `target` according to DEDUP_MODE and returns
+    the path the job should point at.
+    """
+    if DEDUP_MODE != 'link' or os.path.exists(target):
+        return existing
+    try:
+        os.link(existing, target)
+        return target
+    except OSError as e:
+        # Cross-device links and filesystems without hard links end up here.
+        log.warning(f"Could not hard-link {existing} to {target}, keeping the existing copy: {e}")
+        return existing
@@ -0,0 +1,94 @@
+import os
+import shutil
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+# --- Disk Space Configuration ---
+DOWNLOAD_DIR = os.path.join(os.getcwd(), "downloads")
+# Space always left free on the download disk, on top of what running jobs still need.
+RESERVE_BYTES = int(os.getenv('DISK_RESERVE_MB', 512)) * 1048576
+# How long a job that does not fit waits before it is admitted again.
+RECHECK_SECONDS = int(os.getenv('DISK_RECHECK_SECONDS', 300))
+
+def _allocated_bytes(path):
+    """Bytes of `path` that already occupy the disk (preallocated or written)."""
+    try:
+        return os.stat(path).st_blocks * 512
+    except (OSError, AttributeError):
+        return 0
+
+class DiskSpaceManager:
+    """
+    Admission control for the download disk.
+
+    Each admitted job holds a reservation for the bytes it still has to put on disk.
+    A job is only admitted if its own needs, the outstanding reservations of the
+    jobs already running and RESERVE_BYTES all fit into the free space. Reservations
+    are never taken back, so a large job that does not fit waits instead of
+    pushing out smaller ones that do.
+    """
+
+    def __init__(self, path=DOWNLOAD_DIR, reserve_bytes=RESERVE_BYTES):
+        self.path = path
+        self.reserve_bytes = reserve_bytes
+        self._lock = threading.Lock()
+        # download_id -> (total size, .part path or None)
+        self._reservations = {}
+
+    def _usage(self):
+        os.makedirs(self.path, exist_ok=True)
+        return shutil.disk_usage(self.path)
+
+    @staticmethod
+    def _outstanding(size, part_path):
+        # Whatever is already allocated to the .part file is part of the disk usage, not of the reservation.
+        allocated = _allocated_bytes(part_path) if part_path else 0
+        return max(0, size - allocated)
+
+    def _reserved_by_others(self, download_id):
+        return sum(
+            self._outstanding(size, part_path)
+            for job_id, (size, part_path) in self._reservations.items()
+            if job_id != download_id
+        )
+
+    def reserve(self, download_id, size, part_path=None):
+        """
+        Reserves room for a job that needs `size` bytes in total. Returns False if it does
+        not fit right now. Jobs of unknown size are admitted without a reservation.
+        """
+        if not size:
+            return True
+        with self._lock:
+            needed = self._outstanding(size, part_path)
+            reserved = self._reserved_by_others(download_id)
+            free = self._usage().free
+            if needed + reserved + self.reserve_bytes > free:
+                log.warning(
+                    f"[Job {download_id}]: Needs {needed / 1048576:.0f} MiB but only {free / 1048576:.0f} MiB are free "
+                    f"({reserved / 1048576:.0f} MiB reserved by running jobs, {self.reserve_bytes / 1048576:.0f} MiB kept spare)."
+                )
+                return False
+            self._reservations[download_id] = (size, part_path)
+            return True
+
+    def release(self, download_id):
+        with self._lock:
+            self._reservations.pop(download_id, None)
+
+    def stats(self):
+        with self._lock:
+            jobs = {job_id: self._outstanding(size, part_path) for job_id, (size, part_path) in self._reservations.items()}
+        usage = self._usage()
+        return {
+            'free_bytes': usage.free,
+            'total_bytes': usage.total,
+            'reserved_bytes': sum(jobs.values()),
+            'spare_bytes': self.reserve_bytes,
+            'available_bytes': max(0, usage.free - sum(jobs.values()) - self.reserve_bytes),
+            'jobs': jobs,
+        }
+
+disk_space = DiskSpaceManager()
@@ -1,42 +1,95 @@
-from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 import time
 import re
 import os
-import random
 import requests
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from telegram_notifier import send_notification
-from file_parser import parse_filename
 from tqdm import tqdm
 from werkzeug.utils import secure_filename
+from bs4 import BeautifulSoup
+from fichier_resolver import FichierHttpResolver
+from browser_pool import LEAN_MODE, start_chrome, get_shared_pool, browser_rss_bytes, recycle_reason
+from transfer_writer import TransferWriter, preallocate
+from dedup import PROBE_BYTES, new_hasher, probe_hash, hash_file, read_range, adopt_duplicate
 
 log = logging.getLogger(__name__)
 
+CHUNK_SIZE = 1048576
+# Persist the resume offset every time this many bytes have been written.
+CHECKPOINT_BYTES = 32 * CHUNK_SIZE
+# How many times a broken transfer is resumed before the job is considered failed.
+MAX_RESUME_ATTEMPTS = 5
+# How many cooldowns are waited out in-process before a download gives up.
+MAX_WAIT_RETRIES = 3
+# Segmented transfers never split a file into pieces smaller than this.
+MIN_SEGMENT_SIZE = 16 * CHUNK_SIZE
+
 class DownloadCancelledError(Exception):
     """Custom exception to indicate that a download was cancelled."""
     pass
+
+class DownloadDeferredError(Exception):
+    """Raised instead of sleeping when a 1fichier cooldown is hit and cooldowns are deferred to the scheduler."""
+
+    def __init__(self, wait_seconds):
+        super().__init__(f"Cooldown of {wait_seconds} seconds")
+        self.wait_seconds = wait_seconds
+
+class InsufficientSpaceError(Exception):
+    """Raised before a transfer starts when the download disk cannot hold the file."""
+
+    def __init__(self, size):
+        super().__init__(f"Not enough disk space for {size} bytes")
+        self.size = size
+
+class RangeNotSupportedError(requests.exceptions.RequestException):
+    """Raised when the server stops honouring byte ranges in the middle of a segmented transfer."""
+    pass
+
+class _Segment:
+    """A byte range [start, end] of a segmented transfer and how far it has been written."""
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.position = start
+
+    @property
+    def done(self):
+        return self.position > self.end
+
 class FichierDownloader:
     """Manages a persistent browser session to download files from 1fichier."""
 
-    def __init__(self, download_dir=None, wait_time_minutes=10):
+    def __init__(self, download_dir=None, wait_time_minutes=10, segments=1, use_http_resolver=True, defer_cooldowns=False, show_progress_bar=True, duplicate_finder=None):
         self.download_dir = download_dir or os.path.join(os.getcwd(), "downloads")
         if not os.path.exists(self.download_dir):
             os.makedirs(self.download_dir)
         
         self.wait_time_seconds = wait_time_minutes * 60
+        # Number of parallel connections used for a single file (1 = plain single stream).
+        self.segments = max(1, segments)
+        # Pages are resolved over plain HTTP first; Chrome is only started when that fails.
+        self.http_resolver = FichierHttpResolver() if use_http_resolver else None
+        self.last_resolver = None
+        # When set, cooldowns raise DownloadDeferredError so the caller can park the job instead of blocking.
+        self.defer_cooldowns = defer_cooldowns
+        # tqdm bars are only useful on an interactive console; headless deployments can turn them off.
+        self.show_progress_bar = show_progress_bar
+        # `duplicate_finder(download_dir, size, probe_hash)` returns the path of a local copy of a file, if any.
+        self.duplicate_finder = duplicate_finder
+        # Where the last finished file ended up and its hashes, see _download_from_link.
+        self.last_file = None
         self.driver = None
-        
-        self.options = Options()
-        self.options.add_argument("--headless=new")
-        self.options.add_argument("--window-size=1920,1080")
-        self.options.add_argument("--no-sandbox")
-        self.options.add_argument("--disable-dev-shm-usage")
+        # Pages loaded by the current browser session, and how often sessions were restarted (by reason).
+        self.pages_served = 0
+        self.recycled = {'pages': 0, 'memory': 0}
 
     def _save_error_debug_info(self):
         """Saves a screenshot and page source to a timestamped debug folder."""
@@ -65,7 +118,8 @@ class FichierDownloader:
     def start_session(self):
         if not self.driver:
             log.info("Starting new browser session...")
-            self.driver = webdriver.Chrome(options=self.options)
+            self.driver = start_chrome()
+            self.pages_served = 0
 
     def stop_session(self):
         if self.driver:
@@ -73,21 +127,91 @@ class FichierDownloader:
             self.driver.quit()
             self.driver = None
 
-    def download_file(self, url, status_callback, cancellation_check=None):
+    def recycle_session_if_needed(self):
+        """
+        Restarts the browser between jobs once it has served too many pages or its processes
+        use too much memory. The next fallback starts a fresh session. Returns the reason, if any.
+        """
         if not self.driver:
-            raise Exception("Browser session not started. Call start_session() first.")
-
+            return None
+        reason = recycle_reason(self.driver, self.pages_served)
+        if reason:
+            log.info(f"Recycling browser session after {self.pages_served} pages ({reason} watermark reached).")
+            self.recycled[reason] += 1
+            self.stop_session()
+        return reason
+
+    def browser_stats(self):
+        driver = self.driver
+        return {
+            'running': driver is not None,
+            'pages': self.pages_served if driver else 0,
+            'rss_bytes': (browser_rss_bytes(driver) or 0) if driver else 0,
+            'recycled': dict(self.recycled),
+        }
+
+    def download_file(self, url, status_callback, cancellation_check=None, resume=None, checkpoint_callback=None, throttle=None, reserve_space=None, download_id=None, _wait_retries=0):
+        """
+        Resolves a 1fichier page and downloads the file behind it.
+        `resume` may hold the 'part_path' and 'offset' of a previous, interrupted transfer,
+        and `checkpoint_callback(part_path, offset, total_size)` is called as the transfer progresses.
+        `throttle(nbytes)`, if given, is called for every chunk received and may sleep to shape bandwidth.
+        `reserve_space(total_size, part_path)`, if given, is asked for room on disk once the exact size is
+        known; when it returns False, InsufficientSpaceError is raised before anything is written.
+        `download_id`, if given, goes into the .part file's name, so concurrent jobs for one file stay apart.
+        The resolver that produced the final link ('http' or 'browser') is left in `self.last_resolver`,
+        and the path, size and hashes of the finished file in `self.last_file`.
+        """
+        self.last_resolver = None
+        self.last_file = None
         try:
             if cancellation_check and cancellation_check():
                 raise DownloadCancelledError()
 
+            if _wait_retries > MAX_WAIT_RETRIES:
+                log.error(f"Still in cooldown after {MAX_WAIT_RETRIES} waits, giving up.")
+                status_callback("failed")
+                return False
+
+            # --- Fast path: plain HTTP, no browser involved ---
+            if self.http_resolver:
+                resolution = self.http_resolver.resolve(url, cancellation_check)
+                if resolution['status'] == 'cancelled':
+                    raise DownloadCancelledError()
+
+                if resolution['status'] == 'dead':
+                    log.error("File does not exist or has been deleted.")
+                    status_callback("failed")
+                    return False
+
+                if resolution['status'] == 'wait':
+                    self._handle_wait_condition(status_callback, cancellation_check, resolution.get('wait_seconds'))
+                    return self.download_file(url, status_callback, cancellation_check, resume, checkpoint_callback, throttle, reserve_space, download_id, _wait_retries + 1)
+
+                if resolution['status'] == 'link':
+                    self.last_resolver = 'http'
+                    status_callback("processing")
+                    log.info("Resolved the download link over HTTP.")
+                    self._download_from_link(resolution['url'], status_callback, cancellation_check, resume, checkpoint_callback, throttle, reserve_space, download_id)
+                    status_callback("done", progress=100)
+                    return True
+
+                log.info("HTTP resolver could not handle the page, falling back to the browser.")
+
+            # --- Fallback: drive the page with Chrome ---
+            if not self.driver:
+                self.start_session()
+
             self.driver.get(url)
+            self.pages_served += 1
 
-            try:
-                cookie_button = WebDriverWait(self.driver, 5).until(EC.presence_of_element_located((By.CLASS_NAME, 'cmpboxbtnyes')))
-                self.driver.execute_script("arguments[0].click();", cookie_button)
-            except TimeoutException:
-                pass
+            # Lean sessions block the consent manager, so there is no banner to wait for.
+            if not LEAN_MODE:
+                try:
+                    cookie_button = WebDriverWait(self.driver, 5).until(EC.presence_of_element_located((By.CLASS_NAME, 'cmpboxbtnyes')))
+                    self.driver.execute_script("arguments[0].click();", cookie_button)
+                except TimeoutException:
+                    pass
 
             page_text = self.driver.find_element(By.TAG_NAME, 'body').text
 
@@ -99,7 +223,7 @@ class FichierDownloader:
             if "vous devez attendre entre chaque téléchargement" in page_text:
                 self._handle_wait_condition(status_callback, cancellation_check)
                 # After waiting, retry the download for the same URL
-                return self.download_file(url, status_callback, cancellation_check)
+                return self.download_file(url, status_callback, cancellation_check, resume, checkpoint_callback, throttle, reserve_space, download_id, _wait_retries + 1)
 
             # --- Page is valid, now we can set the status to processing ---
             status_callback("processing")
@@ -107,7 +231,8 @@ class FichierDownloader:
             download_url = self._get_final_download_link(status_callback, cancellation_check)
             
             if download_url:
-                self._download_from_link(download_url, status_callback, cancellation_check)
+                self.last_resolver = 'browser'
+                self._download_from_link(download_url, status_callback, cancellation_check, resume, checkpoint_callback, throttle, reserve_space, download_id)
                 status_callback("done", progress=100)
                 return True
             else:
@@ -119,46 +244,55 @@ class FichierDownloader:
         except DownloadCancelledError:
             log.info("Download was cancelled by the user.")
             return False
+        except (DownloadDeferredError, InsufficientSpaceError):
+            raise
         except Exception as e:
             log.error(f"An unexpected error occurred: {e}", exc_info=True)
             self._save_error_debug_info()
             status_callback("failed")
             return False
 
-    def _handle_wait_condition(self, status_callback, cancellation_check):
-        """Parses the wait time from the download button and waits accordingly."""
+    def _handle_wait_condition(self, status_callback, cancellation_check, parsed_seconds=None):
+        """
+        Waits out a 1fichier cooldown, or raises DownloadDeferredError when cooldowns are deferred.
+        `parsed_seconds` comes from the HTTP resolver; otherwise the wait time is parsed
+        from the download button in the browser.
+        """
         status_callback("pending")
         # Set a default wait time in case parsing fails
         wait_seconds = self.wait_time_seconds 
 
-        try:
-            # Find the button with the countdown timer, which has id='dlw'
-            timer_button = self.driver.find_element(By.ID, 'dlw')
-            button_text = timer_button.text
+        if parsed_seconds:
+            wait_seconds = parsed_seconds + 5
+            log.warning(f"Wait condition detected. Waiting for {wait_seconds} seconds based on page text.")
+        elif self.driver:
+            try:
+                # Find the button with the countdown timer, which has id='dlw'
+                timer_button = self.driver.find_element(By.ID, 'dlw')
+                button_text = timer_button.text
             
-            # Use regex to find the number of seconds in the button's text
-            seconds_match = re.search(r'(\d+)', button_text)
+                # Use regex to find the number of seconds in the button's text
+                seconds_match = re.search(r'(\d+)', button_text)
             
-            if seconds_match:
-                parsed_seconds = int(seconds_match.group(1))
-                if parsed_seconds > 0:
-                    # Add a small buffer (e.g., 5 seconds) to account for script execution delays
-                    wait_seconds = parsed_seconds + 5 
-                    log.warning(f"Wait condition detected. Waiting for {wait_seconds} seconds based on page timer.")
+                if seconds_match:
+                    parsed_seconds = int(seconds_match.group(1))
+                    if parsed_seconds > 0:
+                        # Add a small buffer (e.g., 5 seconds) to account for script execution delays
+                        wait_seconds = parsed_seconds + 5 
+                        log.warning(f"Wait condition detected. Waiting for {wait_seconds} seconds based on page timer.")
+                    else:
+                        log.warning(f"Parsed 0 or negative seconds from timer, using default wait.")
                 else:
-                    log.warning(f"Parsed 0 or negative seconds from timer, using default wait.")
-            else:
-                log.warning(f"Could not parse seconds from button text: '{button_text}'. Falling back to default wait.")
+                    log.warning(f"Could not parse seconds from button text: '{button_text}'. Falling back to default wait.")
 
-        except Exception as e:
-            log.error(f"Could not find or parse timer element (id='dlw'), falling back to default wait. Error: {e}")
+            except Exception as e:
+                log.error(f"Could not find or parse timer element (id='dlw'), falling back to default wait. Error: {e}")
+
+        if self.defer_cooldowns:
+            raise DownloadDeferredError(wait_seconds)
 
         # Wait for the calculated duration, checking for cancellation every second
-        wait_start_time = time.time()
-        while time.time() - wait_start_time < wait_seconds:
-            if cancellation_check and cancellation_check():
-                raise DownloadCancelledError()
-            time.sleep(1)
+        self._wait_with_cancellation(wait_seconds, cancellation_check)
         log.info("Wait finished, proceeding to retry download.")
 
 
@@ -197,112 +331,394 @@ class FichierDownloader:
         except TimeoutException:
             return None
 
-    def _download_from_link(self, link, status_callback, cancellation_check=None):
+    @staticmethod
+    def _filename_from_response(response, link):
+        if "content-disposition" in response.headers:
+            cd = response.headers['content-disposition']
+            fname_match = re.search('filename="(.+)"', cd)
+            if fname_match:
+                return secure_filename(fname_match.group(1))
+            return "downloaded_file"
+        return secure_filename(link.split('/')[-1])
+
+    @staticmethod
+    def _range_start(response):
+        """Returns the first byte served by a 206 response, or None if the Range was ignored."""
+        if response.status_code != 206:
+            return None
+        range_match = re.match(r'bytes (\d+)-', response.headers.get('content-range', ''))
+        return int(range_match.group(1)) if range_match else None
+
+    @staticmethod
+    def _total_size(response, offset):
+        range_match = re.search(r'/(\d+)$', response.headers.get('content-range', ''))
+        if range_match:
+            return int(range_match.group(1))
+        content_length = int(response.headers.get('content-length', 0))
+        return content_length + offset if content_length else 0
+
+    def _fetch_range(self, link, start, end):
+        """Returns the response and up to end - start + 1 leading bytes of a Range request."""
+        data = bytearray()
+        with requests.get(link, stream=True, timeout=30, headers={'Range': f'bytes={start}-{end}'}) as r:
+            r.raise_for_status()
+            if self._range_start(r) != start and start > 0:
+                raise RangeNotSupportedError(f"Server ignored the Range request for byte {start}.")
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                data += chunk
+                if len(data) > end - start:
+                    break
+        return r, bytes(data[:end - start + 1])
+
+    def _probe(self, link):
+        """Fetches the filename, size and probe hash of the file behind a direct link, or None."""
+        try:
+            r, head = self._fetch_range(link, 0, PROBE_BYTES - 1)
+        except requests.exceptions.RequestException as e:
+            log.warning(f"Could not probe {link} for duplicates: {e}")
+            return None
+        size = self._total_size(r, 0)
+        if not size or len(head) < min(size, PROBE_BYTES):
+            return None
+        return self._filename_from_response(r, link), size, probe_hash(head, size)
+
+    def _find_duplicate(self, link, probe):
+        """Returns the path of a local copy of the probed file, or None."""
+        filename, size, fingerprint = probe
+        existing = self.duplicate_finder(self.download_dir, size, fingerprint)
+        if not existing:
+            return None
+        # The probe hash only covers the head of the file, so compare the tail as well before trusting it.
+        if size > PROBE_BYTES:
+            tail_start = max(PROBE_BYTES, size - PROBE_BYTES)
+            try:
+                _, tail = self._fetch_range(link, tail_start, size - 1)
+            except requests.exceptions.RequestException as e:
+                log.warning(f"Could not compare the tail of {filename} with {existing}: {e}")
+                return None
+            if tail != read_range(existing, tail_start, size - tail_start):
+                log.info(f"{existing} matches the head of {filename} but not its tail, downloading it.")
+                return None
+        return existing
+
+    def _wait_with_cancellation(self, seconds, cancellation_check=None):
+        # Event-based tokens wake up the moment they are cancelled instead of being polled.
+        if hasattr(cancellation_check, 'wait'):
+            if cancellation_check.wait(seconds):
+                raise DownloadCancelledError()
+            return
+        wait_start_time = time.time()
+        while time.time() - wait_start_time < seconds:
+            if cancellation_check and cancellation_check():
+                raise DownloadCancelledError()
+            time.sleep(1)
+
+    def _split_segments(self, total_size):
+        count = min(self.segments, total_size // MIN_SEGMENT_SIZE) if total_size > 0 else 0
+        if count < 2:
+            return []
+        size = total_size // count
+        bounds = [i * size for i in range(count)] + [total_size]
+        return [_Segment(bounds[i], bounds[i + 1] - 1) for i in range(count)]
+
+    @staticmethod
+    def _contiguous_bytes(segments):
+        """Returns the length of the fully written prefix of a segmented transfer, usable as a resume offset."""
+        for segment in segments:
+            if not segment.done:
+                return segment.position
+        return segments[-1].end + 1
+
+    def _fetch_segment(self, link, part_path, segment, stop_event, throttle=None):
+        attempt = 0
+        while not segment.done and not stop_event.is_set():
+            try:
+                headers = {'Range': f'bytes={segment.position}-{segment.end}'}
+                with requests.get(link, stream=True, timeout=30, headers=headers) as r:
+                    r.raise_for_status()
+                    if self._range_start(r) != segment.position:
+                        raise RangeNotSupportedError(f"Server did not honour range starting at byte {segment.position}.")
+                    with open(part_path, 'r+b') as f:
+                        f.seek(segment.position)
+                        for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                            if stop_event.is_set():
+                                return
+                            chunk = chunk[:segment.end - segment.position + 1]
+                            f.write(chunk)
+                            segment.position += len(chunk)
+                            if throttle:
+                                throttle(len(chunk))
+                            if segment.done:
+                                break
+            except RangeNotSupportedError:
+                raise
+            except requests.exceptions.RequestException as e:
+                attempt += 1
+                if attempt > MAX_RESUME_ATTEMPTS:
+                    raise
+                log.warning(f"Segment {segment.start}-{segment.end} interrupted at byte {segment.position} ({e}). Retrying (attempt {attempt}/{MAX_RESUME_ATTEMPTS}).")
+                stop_event.wait(min(60, 2 ** attempt))
+
+    def _download_segmented(self, link, part_path, segments, filename, status_callback, cancellation_check=None, checkpoint_callback=None, throttle=None):
+        """Fetches the byte ranges of `segments` on parallel connections into one preallocated file."""
+        total_size = segments[-1].end + 1
+        log.info(f"Server accepts ranges, downloading {filename} over {len(segments)} connections.")
+        with open(part_path, 'wb') as f:
+            preallocate(f, total_size)
+        if checkpoint_callback:
+            checkpoint_callback(part_path, 0, total_size)
+
+        stop_event = threading.Event()
+        last_reported_progress = -1
+        last_checkpoint = 0
+        status_callback("downloading", progress=0)
+
+        prefix = f"{threading.current_thread().name}-segment"
+        with ThreadPoolExecutor(max_workers=len(segments), thread_name_prefix=prefix) as executor, tqdm(
+            total=total_size,
+            unit='iB',
+            unit_scale=True,
+            desc=filename,
+            ncols=100,
+            disable=not self.show_progress_bar
+        ) as bar:
+            futures = [executor.submit(self._fetch_segment, link, part_path, segment, stop_event, throttle) for segment in segments]
+            try:
+                while not all(future.done() for future in futures):
+                    if hasattr(cancellation_check, 'wait'):
+                        cancellation_check.wait(0.5)
+                    else:
+                        stop_event.wait(0.5)
+                    if cancellation_check and cancellation_check():
+                        raise DownloadCancelledError()
+                    # Surface the first failure immediately instead of waiting for the other segments.
+                    for future in futures:
+                        if future.done() and future.exception():
+                            raise future.exception()
+
+                    downloaded = sum(segment.position - segment.start for segment in segments)
+                    bar.update(downloaded - bar.n)
+                    progress = (downloaded / total_size) * 100
+                    if progress >= last_reported_progress + 0.1:
+                        status_callback("downloading", progress=round(progress, 2))
+                        last_reported_progress = progress
+
+                    contiguous = self._contiguous_bytes(segments)
+                    if checkpoint_callback and contiguous - last_checkpoint >= CHECKPOINT_BYTES:
+                        checkpoint_callback(part_path, contiguous, total_size)
+                        last_checkpoint = contiguous
+
+                for future in futures:
+                    future.result()
+                bar.update(total_size - bar.n)
+            finally:
+                stop_event.set()
+
+    def _download_from_link(self, link, status_callback, cancellation_check=None, resume=None, checkpoint_callback=None, throttle=None, reserve_space=None, download_id=None):
         log.info("Starting file transfer...")
+        # Data is written to a '.part' file and only renamed once complete, so an
+        # interrupted transfer can pick up where it left off with a Range request.
+        part_path = (resume or {}).get('part_path')
+        offset = (resume or {}).get('offset') or 0
+        if part_path and os.path.exists(part_path):
+            offset = min(offset, os.path.getsize(part_path))
+        else:
+            part_path, offset = None, 0
+
+        filename = None
+        total_size = 0
+        attempt = 0
+        probe = None
+        content_hasher = None
+        # Cleared for the rest of the job once the server refuses a segment's range.
+        segmented = self.segments > 1
+
+        # Fresh transfers are fingerprinted first, so content that is already on disk is never downloaded twice.
+        if part_path is None and self.duplicate_finder:
+            probe = self._probe(link)
+            existing = self._find_duplicate(link, probe) if probe else None
+            if existing:
+                filename, size, fingerprint = probe
+                file_path = adopt_duplicate(existing, os.path.join(self.download_dir, filename))
+                self.last_file = {
+                    'file_path': file_path, 'filename': filename, 'size': size, 'probe_hash': fingerprint,
+                    'content_hash': None, 'deduplicated': True, 'owned': file_path != existing,
+                }
+                status_callback("done", progress=100)
+                log.info(f"{filename} is already on disk as {existing}, skipping the transfer.")
+                return
+
         try:
-            with requests.get(link, stream=True, timeout=30) as r:
-                r.raise_for_status()
-                filename = "downloaded_file"
-                if "content-disposition" in r.headers:
-                    cd = r.headers['content-disposition']
-                    fname_match = re.search('filename="(.+)"', cd)
-                    if fname_match:
-                        filename = secure_filename(fname_match.group(1))
-                else:
-                    filename = secure_filename(link.split('/')[-1])
-
-                filepath = os.path.join(self.download_dir, filename)
-                total_size = int(r.headers.get('content-length', 0))
-                downloaded = 0
-                last_reported_progress = -1
-
-                status_callback("downloading", progress=0)
-                with open(filepath, 'wb') as f, tqdm(
-                    total=total_size,
-                    unit='iB',
-                    unit_scale=True,
-                    desc=filename,
-                    ncols=100
-                ) as bar:
-                    for chunk in r.iter_content(chunk_size=1048576):
-                        if cancellation_check and cancellation_check():
-                            raise DownloadCancelledError()
-                        
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        bar.update(len(chunk))
-                        progress = (downloaded / total_size) * 100 if total_size > 0 else 0
-                        
-                        if progress >= last_reported_progress + 0.1:
-                            status_callback("downloading", progress=round(progress, 2))
-                            last_reported_progress = progress
-            
-            status_callback("done", progress=100)
-            log.info(f"File downloaded successfully to {filename}")
-
-            media_info = parse_filename(filename)
-            title = media_info.get('title', filename)
-            media_type = media_info.get('type', 'file')
-
-            if media_type == 'tv_show':
-                media_type = 'TV show'
-                title = f"{title} S{media_info.get('season', ''):02d}E{media_info.get('episode', ''):02d}"
-
-            message_templates = [
-                f"Hey! Your {media_type} '{title}' is ready. Grab some popcorn! 🍿",
-                f"Success! '{title}' has finished downloading. Hope you enjoy it! 🎬",
-                f"Good news! Your {media_type} '{title}' has arrived. Time for a movie night! ✨",
-                f"Voilà! '{title}' is downloaded and waiting for you. 🎉",
-                f"Mission accomplished. Your {media_type} '{title}' is now in your collection. 🚀",
-                f"Beep boop... Download complete! '{title}' is ready for viewing. 🤖",
-                f"The eagle has landed. I repeat, '{title}' has landed. 🦅",
-                f"It's here! '{title}' has been successfully retrieved from the digital cosmos. 🌌",
-                f"Your download of '{title}' is complete. Let the binge-watching commence! 📺",
-                f"I've got your {media_type}! '{title}' is downloaded and ready to roll. 🎞️"
-            ]
-            
-            final_message = random.choice(message_templates)
-            send_notification(final_message)
+            while True:
+                headers = {'Range': f'bytes={offset}-'} if offset > 0 else {}
+                if offset == 0 and segmented:
+                    # An open-ended range tells us whether the server supports segmented transfers.
+                    headers = {'Range': 'bytes=0-'}
+                try:
+                    with requests.get(link, stream=True, timeout=30, headers=headers) as r:
+                        if r.status_code == 416 and offset > 0:
+                            log.warning(f"Server rejected resume offset {offset}. Restarting transfer from byte 0.")
+                            offset = 0
+                            continue
+                        r.raise_for_status()
+
+                        filename = filename or self._filename_from_response(r, link)
+                        if part_path is None:
+                            # Named after the job too, so two jobs for the same file never share a .part file.
+                            part_name = f"{filename}.{download_id}.part" if download_id is not None else f"{filename}.part"
+                            part_path = os.path.join(self.download_dir, part_name)
+
+                        if offset > 0:
+                            if self._range_start(r) == offset:
+                                log.info(f"Resuming transfer of {filename} from byte {offset}.")
+                            else:
+                                log.warning("Server ignored the Range request. Restarting transfer from byte 0.")
+                                offset = 0
+
+                        total_size = self._total_size(r, offset)
+                        if reserve_space and not reserve_space(total_size, part_path):
+                            raise InsufficientSpaceError(total_size)
+                        segments = self._split_segments(total_size) if segmented and offset == 0 and self._range_start(r) == 0 else []
+                        if len(segments) > 1:
+                            r.close()
+                            # Segments land out of order, so the content hash is computed once the file is complete.
+                            content_hasher = None
+                            try:
+                                self._download_segmented(link, part_path, segments, filename, status_callback, cancellation_check, checkpoint_callback, throttle)
+                            finally:
+                                offset = self._contiguous_bytes(segments)
+                            break
 
-        except requests.exceptions.RequestException as e:
-            log.error(f"An error occurred during download: {e}")
+                        last_reported_progress = -1
+                        last_checkpoint = offset
+                        if checkpoint_callback:
+                            checkpoint_callback(part_path, offset, total_size)
+
+                        status_callback("downloading", progress=round((offset / total_size) * 100, 2) if total_size > 0 else 0)
+                        # The hash is updated as chunks are written; a resumed transfer re-reads its prefix once.
+                        content_hasher = new_hasher()
+                        if offset > 0:
+                            hash_file(part_path, offset, content_hasher)
+                        # Disk writes happen on the writer's own thread; this loop only reads from the network.
+                        with TransferWriter(part_path, offset, total_size, buffer_size=CHUNK_SIZE, hasher=content_hasher) as writer, tqdm(
+                            total=total_size,
+                            initial=offset,
+                            unit='iB',
+                            unit_scale=True,
+                            desc=filename,
+                            ncols=100,
+                            disable=not self.show_progress_bar
+                        ) as bar:
+                            for length in writer.chunks(r):
+                                if cancellation_check and cancellation_check():
+                                    raise DownloadCancelledError()
+
+                                offset += length
+                                bar.update(length)
+                                if throttle:
+                                    throttle(length)
+                                progress = (offset / total_size) * 100 if total_size > 0 else 0
+
+                                if progress >= last_reported_progress + 0.1:
+                                    status_callback("downloading", progress=round(progress, 2))
+                                    last_reported_progress = progress
+
+                                # Only checkpoint what the writer has actually handed to the OS.
+                                if checkpoint_callback and writer.position - last_checkpoint >= CHECKPOINT_BYTES:
+                                    checkpoint_callback(part_path, writer.position, total_size)
+                                    last_checkpoint = writer.position
+
+                    if total_size > 0 and offset < total_size:
+                        raise requests.exceptions.ChunkedEncodingError(f"Connection closed at byte {offset} of {total_size}.")
+                    break
+
+                except requests.exceptions.RequestException as e:
+                    if cancellation_check and cancellation_check():
+                        raise DownloadCancelledError()
+                    attempt += 1
+                    if isinstance(e, RangeNotSupportedError) and segmented:
+                        log.warning(f"Server stopped honouring ranges, continuing {filename} over a single connection.")
+                        segmented = False
+                    if checkpoint_callback and part_path:
+                        checkpoint_callback(part_path, offset, total_size)
+                    if attempt > MAX_RESUME_ATTEMPTS or part_path is None:
+                        log.error(f"An error occurred during download: {e}")
+                        raise
+                    delay = min(60, 2 ** attempt)
+                    log.warning(f"Transfer interrupted at byte {offset} ({e}). Resuming in {delay}s (attempt {attempt}/{MAX_RESUME_ATTEMPTS}).")
+                    self._wait_with_cancellation(delay, cancellation_check)
+
+        except DownloadCancelledError:
+            if part_path and os.path.exists(part_path):
+                os.remove(part_path)
             raise
 
+        filepath = os.path.join(self.download_dir, filename)
+        os.replace(part_path, filepath)
+        if checkpoint_callback:
+            checkpoint_callback(None, offset, total_size)
+
+        content_hash = (content_hasher or hash_file(filepath)).hexdigest()
+        fingerprint = probe[2] if probe else probe_hash(read_range(filepath, 0, PROBE_BYTES), offset)
+        self.last_file = {
+            'file_path': filepath, 'filename': filename, 'size': offset, 'probe_hash': fingerprint,
+            'content_hash': content_hash, 'deduplicated': False, 'owned': True,
+        }
+
+        # Metadata lookup, library placement and the notification happen in the post-processing stage.
+        status_callback("done", progress=100)
+        log.info(f"File downloaded successfully to {filename} (content hash {content_hash}).")
+
+
 def get_filename_from_url(url):
-    """Uses a temporary Selenium session to get the filename from a 1fichier URL."""
-    log.info(f"Using Selenium to get filename from {url}")
-    options = Options()
-    options.add_argument("--headless=new")
-    options.add_argument("--window-size=1920,1080")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    
-    driver = None
+    """
+    Gets the filename of a 1fichier URL. The page is fetched over plain HTTP first;
+    a warm session from the shared browser pool is only used when that fails.
+    """
+    return get_file_info_from_url(url)[0]
+
+def get_file_info_from_url(url):
+    """
+    Like get_filename_from_url, but returns a (filename, size) tuple. The size is the
+    approximate one shown on the page, in bytes, or None if it could not be read.
+    """
     try:
-        driver = webdriver.Chrome(options=options)
-        driver.get(url)
-
-        try:
-            cookie_button = WebDriverWait(driver, 5).until(EC.presence_of_element_located((By.CLASS_NAME, 'cmpboxbtnyes')))
-            driver.execute_script("arguments[0].click();", cookie_button)
-            log.info("Clicked the cookie consent button.")
-        except TimeoutException:
-            log.info("Cookie consent button not found, proceeding anyway.")
+        soup = FichierHttpResolver().fetch_page(url)
+        filename = FichierHttpResolver.parse_filename(soup)
+        if filename:
+            log.info(f"Extracted filename over HTTP: {filename}")
+            return filename, FichierHttpResolver.parse_size(soup)
+    except requests.exceptions.RequestException as e:
+        log.warning(f"Could not fetch {url} over HTTP: {e}")
 
-        selector = 'form table.premium td.normal span[style*="font-weight:bold"]'
-                
-        wait = WebDriverWait(driver, 10)
-        filename_element = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, selector)))
-        
-        filename = filename_element.text
-        log.info(f"Successfully extracted filename: {filename}")
-        return filename
+    log.info(f"Using Selenium to get filename from {url}")
+    selector = 'form table.premium td.normal span[style*="font-weight:bold"]'
+    try:
+        with get_shared_pool().session() as session:
+            driver = session.driver
+            driver.get(url)
+
+            # Warm sessions keep the consent cookie, so only a fresh session needs to look for the banner.
+            if session.pages == 0 and not LEAN_MODE:
+                try:
+                    cookie_button = WebDriverWait(driver, 5).until(EC.presence_of_element_located((By.CLASS_NAME, 'cmpboxbtnyes')))
+                    driver.execute_script("arguments[0].click();", cookie_button)
+                    log.info("Clicked the cookie consent button.")
+                except TimeoutException:
+                    log.info("Cookie consent button not found, proceeding anyway.")
+
+            wait = WebDriverWait(driver, 10)
+            filename_element = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, selector)))
+
+            filename = filename_element.text
+            log.info(f"Successfully extracted filename: {filename}")
+            return filename, FichierHttpResolver.parse_size(BeautifulSoup(driver.page_source, 'html.parser'))
     except TimeoutException:
         log.error(f"Timed out waiting for filename element with selector: {selector}")
-        return None
+        return None, None
+    except TimeoutError:
+        log.error(f"No pooled browser session became available to resolve {url}.")
+        return None, None
     except Exception as e:
-        log.error(f"An unexpected error occurred in get_filename_from_url: {e}", exc_info=True)
-        return None
-    finally:
-        if driver:
-            driver.quit()
\ No newline at end of file
+        log.error(f"An unexpected error occurred in get_file_info_from_url: {e}", exc_info=True)
+        return None, None
@@ -0,0 +1,161 @@
+import re
+import time
+import logging
+import requests
+from urllib.parse import urljoin
+from bs4 import BeautifulSoup
+
+log = logging.getLogger(__name__)
+
+USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
+)
+
+DEAD_MARKERS = ["Le fichier demandé n'existe pas", "a été supprimé"]
+WAIT_MARKER = "vous devez attendre entre chaque téléchargement"
+FILENAME_SELECTOR = 'form table.premium td.normal span[style*="font-weight:bold"]'
+# Sizes are shown rounded next to the filename, e.g. "1.37 Go".
+SIZE_PATTERN = re.compile(r'(\d+(?:[.,]\d+)?)\s*([KMGT])[oB]\b', re.IGNORECASE)
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+class FichierHttpResolver:
+    """
+    Runs the 1fichier free-download page flow with plain HTTP requests.
+
+    `resolve()` returns a dict whose 'status' is one of:
+      - 'link': the final download URL is in 'url'
+      - 'dead': the file does not exist anymore
+      - 'wait': a cooldown is active, 'wait_seconds' holds the parsed delay (or None)
+      - 'cancelled': the cancellation check fired during the button countdown
+      - 'unresolved': the page did not look like expected, the caller should fall back to a browser
+    """
+
+    def __init__(self, timeout=15):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({
+            'User-Agent': USER_AGENT,
+            'Accept-Language': 'fr-FR,fr;q=0.9,en;q=0.8',
+        })
+
+    @staticmethod
+    def parse_wait_seconds(page_text):
+        """Extracts the cooldown announced on a 1fichier page, in seconds."""
+        minutes_match = re.search(r'(\d+)\s*minutes?', page_text, re.IGNORECASE)
+        if minutes_match:
+            return int(minutes_match.group(1)) * 60
+        seconds_match = re.search(r'(\d+)\s*secondes?', page_text, re.IGNORECASE)
+        if seconds_match:
+            return int(seconds_match.group(1))
+        return None
+
+    @staticmethod
+    def parse_filename(soup):
+        filename_element = soup.select_one(FILENAME_SELECTOR)
+        return filename_element.get_text(strip=True) if filename_element else None
+
+    @classmethod
+    def parse_size(cls, soup):
+        """Returns the approximate file size shown on a 1fichier page, in bytes, or None."""
+        table = soup.select_one('form table.premium')
+        if not table:
+            return None
+        text = table.get_text(" ", strip=True)
+        filename = cls.parse_filename(soup)
+        if filename:
+            # Don't mistake something like "Movie.4GB.mkv" for the size.
+            text = text.replace(filename, " ")
+        size_match = SIZE_PATTERN.search(text)
+        if not size_match:
+            return None
+        return int(float(size_match.group(1).replace(',', '.')) * SIZE_UNITS[size_match.group(2).upper()])
+
+    @classmethod
+    def is_dead(cls, soup):
+        """True if the page says the file does not exist anymore."""
+        return cls._classify(soup) == 'dead'
+
+    @staticmethod
+    def _classify(soup):
+        """Returns 'dead', 'wait' or None for a parsed 1fichier page."""
+        page_text = soup.get_text(" ", strip=True)
+        if any(marker in page_text for marker in DEAD_MARKERS):
+            return 'dead'
+        if WAIT_MARKER in page_text:
+            return 'wait'
+        return None
+
+    def _wait_for_countdown(self, button, cancellation_check=None):
+        """Honours the countdown of a disabled #dlw button before submitting the form."""
+        countdown_match = re.search(r'(\d+)', button.get_text(" ", strip=True) or button.get('value', ''))
+        countdown = int(countdown_match.group(1)) + 1 if countdown_match else 0
+        if countdown:
+            log.info(f"Download button is counting down, waiting {countdown} seconds before submitting.")
+        if hasattr(cancellation_check, 'wait'):
+            return not cancellation_check.wait(countdown)
+        wait_start_time = time.time()
+        while time.time() - wait_start_time < countdown:
+            if cancellation_check and cancellation_check():
+                return False
+            time.sleep(1)
+        return True
+
+    def fetch_page(self, url):
+        """Fetches and parses a 1fichier page, returning the BeautifulSoup document."""
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return BeautifulSoup(response.text, 'html.parser')
+
+    def resolve(self, url, cancellation_check=None):
+        try:
+            soup = self.fetch_page(url)
+            filename = self.parse_filename(soup)
+
+            condition = self._classify(soup)
+            if condition == 'dead':
+                return {'status': 'dead', 'filename': filename}
+            if condition == 'wait':
+                return {
+                    'status': 'wait',
+                    'filename': filename,
+                    'wait_seconds': self.parse_wait_seconds(soup.get_text(" ", strip=True))
+                }
+
+            button = soup.find(id='dlw')
+            form = button.find_parent('form') if button else None
+            if not form:
+                log.info("HTTP resolver could not find the download form.")
+                return {'status': 'unresolved', 'filename': filename}
+
+            if button.has_attr('disabled') and not self._wait_for_countdown(button, cancellation_check):
+                return {'status': 'cancelled', 'filename': filename}
+
+            payload = {
+                field['name']: field.get('value', '')
+                for field in form.find_all('input')
+                if field.get('name') and field.get('type', 'text') != 'submit'
+            }
+            action = urljoin(url, form.get('action') or url)
+            response = self.session.post(action, data=payload, timeout=self.timeout)
+            response.raise_for_status()
+            result_soup = BeautifulSoup(response.text, 'html.parser')
+
+            if self._classify(result_soup) == 'wait':
+                return {
+                    'status': 'wait',
+                    'filename': filename,
+                    'wait_seconds': self.parse_wait_seconds(result_soup.get_text(" ", strip=True))
+                }
+
+            link = result_soup.select_one('a.ok')
+            if link and link.get('href'):
+                return {'status': 'link', 'filename': filename, 'url': urljoin(action, link['href'])}
+
+            log.info("HTTP resolver submitted the form but found no final download link.")
+            return {'status': 'unresolved', 'filename': filename}
+
+        except requests.exceptions.RequestException as e:
+            log.warning(f"HTTP resolver failed for {url}: {e}")
+            return {'status': 'unresolved', 'filename': None}
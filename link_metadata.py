@@ -0,0 +1,74 @@
+import os
+import time
+import logging
+import threading
+
+import database
+from file_parser import parse_filename
+from fichier_dl import get_file_info_from_url
+
+log = logging.getLogger(__name__)
+
+# --- Cache Configuration ---
+CACHE_TTL_SECONDS = int(os.getenv('LINK_CACHE_TTL_HOURS', 24 * 7)) * 3600
+CACHE_MAX_ENTRIES = int(os.getenv('LINK_CACHE_MAX_ENTRIES', 5000))
+EVICTION_INTERVAL_SECONDS = 600
+# How long to wait before retrying a link whose filename could not be resolved.
+FAILED_LOOKUP_RETRY_SECONDS = 3600
+
+_last_eviction = 0
+_eviction_lock = threading.Lock()
+
+def _evict_if_due():
+    global _last_eviction
+    with _eviction_lock:
+        if time.time() - _last_eviction < EVICTION_INTERVAL_SECONDS:
+            return
+        _last_eviction = time.time()
+    evicted = database.evict_link_metadata(CACHE_TTL_SECONDS, CACHE_MAX_ENTRIES)
+    if evicted:
+        log.info(f"Evicted {evicted} entries from the link metadata cache.")
+
+def get_link_metadata(link):
+    """
+    Returns the filename and parsed media info of a 1fichier link as a dict with
+    'filename' and 'media_info' keys, or None if the filename can't be determined.
+    Fresh cached entries are served without touching 1fichier or TMDb.
+    """
+    cached = database.get_cached_link_metadata(link, CACHE_TTL_SECONDS)
+    if cached and cached['filename'] and cached['media_info'] is not None:
+        log.info(f"Link metadata cache hit for {link}: {cached['filename']}")
+        return cached
+
+    if cached and cached['filename']:
+        # A liveness check already read the page; only the TMDb lookup is missing.
+        filename, size = cached['filename'], None
+    else:
+        filename, size = get_file_info_from_url(link)
+    if not filename:
+        return None
+
+    media_info = parse_filename(filename)
+    # Keep an exact size recorded by a finished download over the rounded one from the page.
+    if cached and cached['size']:
+        size = None
+    database.save_link_metadata(link, filename=filename, size=size, alive=True, media_info=media_info)
+    _evict_if_due()
+    return database.get_cached_link_metadata(link, CACHE_TTL_SECONDS) or {'filename': filename, 'media_info': media_info}
+
+def get_known_size(link):
+    """Returns the size of a link's file from the cache, in bytes, or None if it isn't known yet."""
+    cached = database.get_cached_link_metadata(link, CACHE_TTL_SECONDS)
+    return cached['size'] if cached else None
+
+def prefetch_waiting_metadata(deadline):
+    """Scheduler idle task: resolves the metadata of queued and parked links ahead of time."""
+    for link in database.get_waiting_links():
+        if time.time() >= deadline:
+            return
+        cached = database.get_cached_link_metadata(link, CACHE_TTL_SECONDS)
+        if cached and (cached['filename'] or time.time() - cached['updated_at'] < FAILED_LOOKUP_RETRY_SECONDS):
+            continue
+        if not get_link_metadata(link):
+            # Remember the failed lookup so the link is not retried on every idle cycle.
+            database.save_link_metadata(link)
@@ -0,0 +1,97 @@
+import os
+import time
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+from fichier_resolver import FichierHttpResolver
+
+log = logging.getLogger(__name__)
+
+# --- Liveness Check Configuration ---
+# How many 1fichier pages are fetched at once when checking a batch of links.
+CONCURRENCY = int(os.getenv('LIVENESS_CHECK_CONCURRENCY', 8))
+# Waiting jobs are re-checked when their last check is older than this.
+SWEEP_INTERVAL_SECONDS = int(os.getenv('LIVENESS_SWEEP_MINUTES', 60)) * 60
+
+def check_link(link):
+    """
+    Fetches a 1fichier page over plain HTTP. Returns False if the file is gone,
+    True if it is still there and None if the check itself failed.
+    """
+    try:
+        soup = FichierHttpResolver().fetch_page(link)
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code in (404, 410):
+            database.save_link_metadata(link, alive=False)
+            return False
+        log.warning(f"Liveness check of {link} failed: {e}")
+        return None
+    except requests.exceptions.RequestException as e:
+        log.warning(f"Liveness check of {link} failed: {e}")
+        return None
+
+    if FichierHttpResolver.is_dead(soup):
+        database.save_link_metadata(link, alive=False)
+        return False
+    # The page is already parsed, so keep what it says about the file for the metadata cache.
+    database.save_link_metadata(
+        link,
+        filename=FichierHttpResolver.parse_filename(soup),
+        size=FichierHttpResolver.parse_size(soup),
+        alive=True
+    )
+    return True
+
+def check_links(links):
+    """Checks many links with bounded concurrency. Returns a {link: True/False/None} dict."""
+    links = list(dict.fromkeys(links))
+    if not links:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(CONCURRENCY, len(links)), thread_name_prefix="Liveness") as executor:
+        results = dict(zip(links, executor.map(check_link, links)))
+    dead = sum(1 for alive in results.values() if alive is False)
+    log.info(f"Checked {len(links)} link(s): {dead} dead, {sum(1 for alive in results.values() if alive is None)} unknown.")
+    return results
+
+def sweep_waiting_links(max_age_seconds=SWEEP_INTERVAL_SECONDS):
+    """Re-checks waiting jobs whose links were not checked recently and marks the dead ones. Returns how many were marked."""
+    now = time.time()
+    due = []
+    for link in database.get_waiting_links():
+        cached = database.get_cached_link_metadata(link, float('inf'))
+        if not cached or not cached.get('checked_at') or now - cached['checked_at'] >= max_age_seconds:
+            due.append(link)
+    if not due:
+        return 0
+
+    dead_links = [link for link, alive in check_links(due).items() if alive is False]
+    marked = database.mark_links_dead(dead_links) if dead_links else 0
+    if marked:
+        log.warning(f"Liveness sweep marked {marked} queued job(s) as dead.")
+    return marked
+
+class LivenessSweeper:
+    """Periodically re-checks the links of queued jobs so dead ones never reach a worker."""
+
+    def __init__(self, interval=SWEEP_INTERVAL_SECONDS):
+        self.interval = interval
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._sweep_loop, name="LivenessSweeper", daemon=True)
+            self._thread.start()
+
+    def _sweep_loop(self):
+        while True:
+            try:
+                sweep_waiting_links(self.interval)
+            except Exception as e:
+                log.error(f"Liveness sweep failed: {e}", exc_info=True)
+            # Links come due continuously, so look for them a few times per interval.
+            time.sleep(max(60, self.interval / 4))
+
+liveness_sweeper = LivenessSweeper()
@@ -49,7 +49,8 @@ class EmojiFormatter(logging.Formatter):
 
     def format(self, record):
         # Get emoji for thread/module
-        thread_emoji = self.EMOJI_MAP.get(record.threadName, '⚙️')
+        # Pooled threads are named like 'DownloadWorker-2', so match on the prefix.
+        thread_emoji = self.EMOJI_MAP.get(record.threadName.split('-')[0], '⚙️')
 
         # Get emoji for log level
         level_emoji = self.LEVEL_MAP.get(record.levelno, '📝')
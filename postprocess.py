@@ -0,0 +1,196 @@
+import os
+import re
+import random
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+from file_parser import parse_filename
+from telegram_notifier import send_notification
+
+log = logging.getLogger(__name__)
+
+# --- Post-processing Configuration ---
+MAX_WORKERS = int(os.getenv('POSTPROCESS_WORKERS', 1))
+# Root of the library layout finished files are moved into. Empty keeps them in the downloads directory.
+LIBRARY_DIR = os.getenv('LIBRARY_DIR', '')
+MAX_ATTEMPTS = 3
+RETRY_DELAY_SECONDS = 60
+
+def _safe_name(name):
+    """Makes a title usable as a directory name while keeping it readable."""
+    name = re.sub(r'[<>:"/\\|?*\x00-\x1f]', '', str(name)).strip(' .')
+    return name or 'Unknown'
+
+def library_path(filename, media_info, library_dir=LIBRARY_DIR):
+    """
+    Returns where a file belongs in the library, or None if it should stay put:
+      Movies/<Title> (<Year>)/<filename>
+      TV Shows/<Title>/Season <NN>/<filename>
+    """
+    if not library_dir:
+        return None
+    title = _safe_name(media_info.get('title') or filename)
+    if media_info.get('type') == 'movie':
+        folder = f"{title} ({media_info['year']})" if media_info.get('year') else title
+        return os.path.join(library_dir, 'Movies', folder, filename)
+    if media_info.get('type') == 'tv_show' and media_info.get('season') is not None:
+        return os.path.join(library_dir, 'TV Shows', title, f"Season {media_info['season']:02d}", filename)
+    return None
+
+def _describe(filename, media_info):
+    """Returns a human-readable media type and title for notifications."""
+    title = media_info.get('title', filename)
+    media_type = media_info.get('type', 'file')
+
+    if media_type == 'tv_show':
+        media_type = 'TV show'
+        title = f"{title} S{media_info.get('season', ''):02d}E{media_info.get('episode', ''):02d}"
+    return media_type, title
+
+def completion_message(filename, media_info, deduplicated=False):
+    media_type, title = _describe(filename, media_info)
+    if deduplicated:
+        return f"Your {media_type} '{title}' was already in your collection, no download needed. ♻️"
+
+    message_templates = [
+        f"Hey! Your {media_type} '{title}' is ready. Grab some popcorn! 🍿",
+        f"Success! '{title}' has finished downloading. Hope you enjoy it! 🎬",
+        f"Good news! Your {media_type} '{title}' has arrived. Time for a movie night! ✨",
+        f"Voilà! '{title}' is downloaded and waiting for you. 🎉",
+        f"Mission accomplished. Your {media_type} '{title}' is now in your collection. 🚀",
+        f"Beep boop... Download complete! '{title}' is ready for viewing. 🤖",
+        f"The eagle has landed. I repeat, '{title}' has landed. 🦅",
+        f"It's here! '{title}' has been successfully retrieved from the digital cosmos. 🌌",
+        f"Your download of '{title}' is complete. Let the binge-watching commence! 📺",
+        f"I've got your {media_type}! '{title}' is downloaded and ready to roll. 🎞️"
+    ]
+    return random.choice(message_templates)
+
+class PostProcessor:
+    """
+    Runs the work that follows a finished transfer off the download workers.
+
+    Each finished file gets a row in `postprocess_tasks` and goes through three steps on
+    a small dedicated executor: metadata lookup, placement into the library layout and
+    the Telegram notification. The last completed step is persisted, so a task
+    interrupted by a restart resumes without moving a file twice. The notification only
+    counts once Telegram has accepted it, so it is never lost, though a crash right
+    after sending may repeat it.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="PostProcess")
+
+    def submit(self, download_id, finished_file):
+        """Records a post-processing task for a finished download and queues it. Returns immediately."""
+        task_id = database.add_postprocess_task(
+            download_id,
+            finished_file['file_path'],
+            finished_file.get('filename') or os.path.basename(finished_file['file_path']),
+            owned=finished_file.get('owned', True),
+            deduplicated=finished_file.get('deduplicated', False)
+        )
+        self._executor.submit(self._run, task_id)
+        return task_id
+
+    def resume_unfinished(self):
+        """Re-queues the tasks left behind by a previous run."""
+        task_ids = database.get_unfinished_postprocess_tasks()
+        for task_id in task_ids:
+            self._executor.submit(self._run, task_id)
+        if task_ids:
+            log.info(f"Resumed {len(task_ids)} unfinished post-processing task(s).")
+
+    def _media_info(self, task):
+        # The link metadata cache usually has the TMDb result already, from when the link was queued.
+        download = database.get_download_by_id(task['download_id'])
+        if download and download.get('fichier_link'):
+            cached = database.get_cached_link_metadata(download['fichier_link'], float('inf'))
+            if cached and cached['filename'] == task['filename'] and cached['media_info'] is not None:
+                return cached['media_info']
+        return parse_filename(task['filename'])
+
+    def _place(self, task, media_info):
+        """Moves the file into the library and returns its new path (or the old one if it stays put)."""
+        file_path = task['file_path']
+        if not task['owned']:
+            # The job reuses a copy that belongs to another download; leave it where it is.
+            return file_path
+        destination = library_path(task['filename'], media_info)
+        if not destination or os.path.abspath(destination) == os.path.abspath(file_path):
+            return file_path
+        if not os.path.exists(file_path) and os.path.exists(destination):
+            # Moved before a restart interrupted the task.
+            return destination
+        if os.path.exists(destination):
+            log.warning(f"{destination} already exists, leaving {file_path} in place.")
+            return file_path
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.move(file_path, destination)
+        log.info(f"Moved {task['filename']} to {destination}")
+        return destination
+
+    def _run(self, task_id):
+        task = database.get_postprocess_task(task_id)
+        if not task or task['status'] == 'done':
+            return
+        if task['attempts'] >= MAX_ATTEMPTS:
+            # Every earlier run ended in an error or took the process down with it.
+            log.error(f"[Job {task['download_id']}]: Post-processing gave up after {task['attempts']} attempt(s).")
+            database.update_postprocess_task(task_id, 'failed', error=task['error'] or "Interrupted too many times")
+            return
+        database.start_postprocess_task(task_id)
+        try:
+            media_info = self._media_info(task)
+
+            if task['step'] is None:
+                file_path = self._place(task, media_info)
+                if file_path != task['file_path']:
+                    database.update_download_file_path(task['download_id'], file_path)
+                database.update_postprocess_task(task_id, 'running', step='placed', file_path=file_path)
+
+            # Episodes of the same show finishing close together are announced in a single message.
+            series, episode = None, None
+            if media_info.get('type') == 'tv_show' and not task['deduplicated'] and media_info.get('season') is not None:
+                series = media_info.get('title')
+                episode = f"S{media_info['season']:02d}E{media_info.get('episode') or 0:02d}"
+            delivery = send_notification(completion_message(task['filename'], media_info, bool(task['deduplicated'])), series, episode)
+            # The task is only done once the message is out; waiting here would hold up the episodes it coalesces with.
+            delivery.add_done_callback(lambda future: self._executor.submit(self._notified, task, future))
+
+        except Exception as e:
+            log.error(f"[Job {task['download_id']}]: Post-processing failed: {e}", exc_info=True)
+            self._retry_or_fail(task, e)
+
+    def _notified(self, task, delivery):
+        error = delivery.exception()
+        if error is not None:
+            log.error(f"[Job {task['download_id']}]: Completion notification was not sent: {error}")
+            self._retry_or_fail(task, error)
+            return
+        if not delivery.result():
+            log.info(f"[Job {task['download_id']}]: Completion notification skipped.")
+        database.update_postprocess_task(task['id'], 'done', step='notified')
+        log.info(f"[Job {task['download_id']}]: Post-processing finished.")
+
+    def _retry_or_fail(self, task, error):
+        # `task` was read before this run counted its attempt.
+        if task['attempts'] + 1 >= MAX_ATTEMPTS:
+            database.update_postprocess_task(task['id'], 'failed', error=str(error))
+            return
+        database.update_postprocess_task(task['id'], 'queued', error=str(error))
+        retry = threading.Timer(RETRY_DELAY_SECONDS, self._executor.submit, args=(self._run, task['id']))
+        retry.daemon = True
+        retry.start()
+
+    def stats(self):
+        return {
+            'workers': self.max_workers,
+            'tasks': database.get_postprocess_stats(),
+        }
+
+post_processor = PostProcessor()
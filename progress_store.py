@@ -0,0 +1,109 @@
+import os
+import time
+import logging
+import threading
+
+import database
+
+log = logging.getLogger(__name__)
+
+# Progress-only updates are written to SQLite at most this often.
+FLUSH_INTERVAL_SECONDS = float(os.getenv('PROGRESS_FLUSH_INTERVAL', 5))
+
+class ProgressStore:
+    """
+    In-memory registry of the live status and progress of active downloads.
+
+    Status changes are written to the database immediately. Progress updates only
+    touch memory and are flushed in a single transaction every FLUSH_INTERVAL_SECONDS.
+    API readers overlay the live values on top of the database rows, and every update
+    gets a sequence number so the queue stream can push only what changed.
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL_SECONDS):
+        self.flush_interval = flush_interval
+        self._entries = {}
+        self._lock = threading.Lock()
+        # Serializes database writes so a periodic flush never lands after a newer status write.
+        self._write_lock = threading.Lock()
+        self._flusher = None
+        self._sequence = 0
+        self._listeners = []
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name="ProgressFlusher", daemon=True)
+            self._flusher.start()
+
+    def add_listener(self, callback):
+        """Calls `callback()` after every update, on the worker thread that made it. It must return quickly."""
+        self._listeners.append(callback)
+
+    def update(self, download_id, status, progress=None):
+        with self._lock:
+            entry = self._entries.get(download_id)
+            transition = entry is None or entry['status'] != status
+            if entry is None:
+                entry = self._entries[download_id] = {'status': status, 'download_progress': 0, 'dirty': False}
+            entry['status'] = status
+            if progress is not None:
+                entry['download_progress'] = progress
+            entry['updated_at'] = time.time()
+            # A status write without progress leaves the stored progress alone, so unflushed progress stays dirty.
+            if not (transition and progress is None):
+                entry['dirty'] = not transition
+            self._sequence += 1
+            entry['sequence'] = self._sequence
+
+        if transition:
+            with self._write_lock:
+                database.update_download_status(download_id, status, progress)
+        for callback in self._listeners:
+            callback()
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                dirty = [(entry['download_progress'], download_id) for download_id, entry in self._entries.items() if entry['dirty']]
+                for _, download_id in dirty:
+                    self._entries[download_id]['dirty'] = False
+            if dirty:
+                database.update_download_progress_batch(dirty)
+
+    def finish(self, download_id):
+        """Flushes and forgets a job once its worker is done with it."""
+        self.flush()
+        self.discard(download_id)
+
+    def discard(self, download_id):
+        with self._lock:
+            self._entries.pop(download_id, None)
+
+    def overlay(self, downloads):
+        """Replaces the status and progress of database rows with their live in-memory values."""
+        with self._lock:
+            for download in downloads:
+                entry = self._entries.get(download['id'])
+                if entry:
+                    download['status'] = entry['status']
+                    download['download_progress'] = entry['download_progress']
+        return downloads
+
+    def changes_since(self, sequence):
+        """Returns the current sequence number and {id: {status, download_progress}} for the jobs updated after `sequence`."""
+        with self._lock:
+            changed = {
+                download_id: {'status': entry['status'], 'download_progress': entry['download_progress']}
+                for download_id, entry in self._entries.items() if entry['sequence'] > sequence
+            }
+            return self._sequence, changed
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                log.error(f"Failed to flush download progress: {e}", exc_info=True)
+
+progress_store = ProgressStore()
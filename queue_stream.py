@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import logging
+import threading
+
+import database
+from progress_store import progress_store
+
+log = logging.getLogger(__name__)
+
+# --- Queue Stream Configuration ---
+# Every open /api/queue/stream holds one web server thread; past this many, pages fall back to polling.
+MAX_CONNECTIONS = int(os.getenv('QUEUE_STREAM_MAX_CONNECTIONS', 200))
+# A connection gets at most one update this often, however busy the queue is.
+MIN_INTERVAL_SECONDS = float(os.getenv('QUEUE_STREAM_INTERVAL', 1))
+# Quiet connections get a comment this often, so proxies keep them open and closed tabs are noticed.
+HEARTBEAT_SECONDS = 15
+# How long the browser waits before reconnecting a dropped stream.
+RETRY_MILLISECONDS = 3000
+
+def _event(name, data, event_id=None):
+    """Formats one Server-Sent Event."""
+    lines = [f"event: {name}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
+
+class QueueStream:
+    """
+    Pushes queue changes to the open queue pages as Server-Sent Events.
+
+    Connections sleep on a condition until a database commit or a live progress update
+    wakes them, so an idle viewer costs a parked thread and nothing else. An awake
+    connection waits out MIN_INTERVAL_SECONDS since its last update, then sends at most
+    two events: 'queue', the rows changed since its queue version in the same shape as
+    /api/queue?since=, and 'progress', the live status and progress of the jobs updated
+    since its last update.
+    """
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, min_interval=MIN_INTERVAL_SECONDS, heartbeat=HEARTBEAT_SECONDS):
+        self.max_connections = max_connections
+        self.min_interval = min_interval
+        self.heartbeat = heartbeat
+        self._condition = threading.Condition()
+        # Bumped on every change; database commits also bump `_commits`, so progress alone skips the database.
+        self._sequence = 0
+        self._commits = 0
+        self._connections = 0
+        self._started = False
+        self._stats = {'opened': 0, 'rejected': 0, 'events': 0}
+
+    def start(self):
+        if not self._started:
+            self._started = True
+            database.writer.add_listener(self._on_commit)
+            progress_store.add_listener(self._on_progress)
+
+    def _on_commit(self):
+        with self._condition:
+            self._sequence += 1
+            self._commits += 1
+            self._condition.notify_all()
+
+    def _on_progress(self):
+        with self._condition:
+            self._sequence += 1
+            self._condition.notify_all()
+
+    def open(self, since=None):
+        """
+        Returns the events of a new connection that already has the queue at version `since`
+        (None sends the whole queue first), or None when MAX_CONNECTIONS are already open.
+        """
+        with self._condition:
+            if self._connections >= self.max_connections:
+                self._stats['rejected'] += 1
+                return None
+        return self._events(since)
+
+    def _events(self, since):
+        with self._condition:
+            # Checked again here: the slot is only taken once the server starts sending.
+            if self._connections >= self.max_connections:
+                self._stats['rejected'] += 1
+                yield _event('full', {})
+                return
+            self._connections += 1
+            self._stats['opened'] += 1
+        try:
+            yield f"retry: {RETRY_MILLISECONDS}\n\n"
+            version = since
+            progress_sequence = 0
+            seen, seen_commits = None, None
+            last_sent = 0
+            while True:
+                with self._condition:
+                    woken = self._condition.wait_for(lambda: self._sequence != seen, self.heartbeat)
+                if not woken:
+                    yield ': keep-alive\n\n'
+                    continue
+                # Let further changes pile up until this connection is due for its next update.
+                delay = last_sent + self.min_interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                with self._condition:
+                    seen, commits = self._sequence, self._commits
+                last_sent = time.monotonic()
+
+                if commits != seen_commits:
+                    seen_commits = commits
+                    if version is None or database.get_queue_version() != version:
+                        version, changed, deleted, complete = database.get_queue_changes(-1 if version is None else version)
+                        self._stats['events'] += 1
+                        yield _event('queue', {
+                            'version': version,
+                            'changed': progress_store.overlay(changed),
+                            'deleted': deleted,
+                            'complete': complete,
+                        }, version)
+                progress_sequence, live = progress_store.changes_since(progress_sequence)
+                if live:
+                    self._stats['events'] += 1
+                    yield _event('progress', live)
+        finally:
+            with self._condition:
+                self._connections -= 1
+
+    def stats(self):
+        with self._condition:
+            return dict(self._stats, connections=self._connections, max_connections=self.max_connections)
+
+queue_stream = QueueStream()
@@ -0,0 +1,111 @@
+import os
+import time
+import logging
+import threading
+
+import database
+from disk_space import disk_space, RECHECK_SECONDS
+from link_metadata import get_known_size
+
+log = logging.getLogger(__name__)
+
+# --- Scheduler Configuration ---
+POLL_INTERVAL_SECONDS = 10
+# A job parked more often than this is marked as failed instead of being parked again.
+MAX_DEFERRALS = int(os.getenv('MAX_COOLDOWN_DEFERRALS', 10))
+
+class DownloadScheduler:
+    """
+    Hands jobs to the download workers.
+
+    Jobs that hit a 1fichier cooldown are parked in the database with a `not_before`
+    timestamp instead of blocking a worker. While nothing can start, idle workers run
+    the registered idle tasks, then wake up exactly when the cooldown ends.
+
+    Before a job is handed out, its expected size is checked against the free space of
+    the download disk. Jobs that don't fit are set aside for RECHECK_SECONDS and the
+    next job in line is tried, so smaller downloads keep flowing.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._idle_tasks = []
+        self._idle_lock = threading.Lock()
+
+    def register_idle_task(self, name, func):
+        """Registers `func(deadline)`, run while workers have nothing to download. It should return before `deadline`."""
+        self._idle_tasks.append((name, func))
+
+    def notify(self):
+        """Wakes up idle workers, e.g. after new links were queued."""
+        with self._condition:
+            self._condition.notify_all()
+
+    def park(self, download_id, wait_seconds):
+        not_before = time.time() + wait_seconds
+        deferrals = database.park_download(download_id, not_before)
+        if deferrals is None:
+            return
+        if deferrals > MAX_DEFERRALS:
+            log.error(f"[Scheduler]: Job {download_id} was parked {deferrals} times. Marking as failed.")
+            database.update_download_status(download_id, 'failed')
+            return
+        log.info(
+            f"[Scheduler]: Job {download_id} parked for {wait_seconds}s, "
+            f"until {time.strftime('%H:%M:%S', time.localtime(not_before))}."
+        )
+
+    def defer_for_space(self, download_id):
+        not_before = time.time() + RECHECK_SECONDS
+        database.defer_download_for_space(download_id, not_before)
+        log.info(
+            f"[Scheduler]: Job {download_id} does not fit on the download disk, "
+            f"checking again at {time.strftime('%H:%M:%S', time.localtime(not_before))}."
+        )
+
+    def _admit(self, job):
+        """Reserves disk space for a claimed job, using the best size known before resolving its link."""
+        size = job.get('total_bytes')
+        if not size and job.get('fichier_link'):
+            size = get_known_size(job['fichier_link'])
+        if disk_space.reserve(job['id'], size, job.get('part_path')):
+            return True
+        self.defer_for_space(job['id'])
+        return False
+
+    def _run_idle_tasks(self, deadline):
+        # A single worker runs the idle tasks at a time; the others just wait.
+        if not self._idle_lock.acquire(blocking=False):
+            return
+        try:
+            for name, func in self._idle_tasks:
+                if time.time() >= deadline:
+                    break
+                try:
+                    func(deadline)
+                except Exception as e:
+                    log.error(f"[Scheduler]: Idle task '{name}' failed: {e}", exc_info=True)
+        finally:
+            self._idle_lock.release()
+
+    def next_job(self, worker_name, state_callback=None):
+        """Blocks until a job can be claimed for `worker_name` and returns it."""
+        while True:
+            job = database.claim_next_download(worker_name)
+            if job:
+                if self._admit(job):
+                    return job
+                continue
+
+            cooldown_until = database.get_cooldown_until()
+            if state_callback:
+                state_callback('cooldown' if cooldown_until else 'idle')
+
+            deadline = cooldown_until or time.time() + POLL_INTERVAL_SECONDS
+            self._run_idle_tasks(deadline)
+            with self._condition:
+                remaining = deadline - time.time()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+
+scheduler = DownloadScheduler()
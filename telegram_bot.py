@@ -9,8 +9,10 @@ from telethon.tl.custom import Button
 from dotenv import load_dotenv
 
 import database
-from file_parser import parse_filename
-from fichier_dl import get_filename_from_url
+from link_metadata import get_link_metadata
+from liveness import check_links
+from scheduler import scheduler
+from progress_store import progress_store
 from zt_parser import ZTParser, select_best_movie, select_best_show
 from telegram_parser import TelegramParser
 
@@ -230,7 +232,9 @@ async def queue_command_handler(event):
     log.info("[Bot]: Received /queue command.")
     
     try:
-        queue_items = database.get_active_queue()
+        loop = asyncio.get_running_loop()
+        active_queue = await loop.run_in_executor(None, database.get_active_queue)
+        queue_items = progress_store.overlay(active_queue)
 
         if not queue_items:
             await event.respond("✅ The download queue is currently empty.")
@@ -262,35 +266,28 @@ async def queue_command_handler(event):
 async def process_link(link, loop):
     """Processes a single 1fichier link."""
     try:
-        filename = await loop.run_in_executor(None, get_filename_from_url, link)
-        if not filename:
-            log.error(f"Could not determine filename for link: {link}")
-            return None, f"- {link} (Could not get filename)"
-
-        if database.is_link_already_added(link):
+        if await loop.run_in_executor(None, database.is_link_already_added, link):
             log.warning(f"Link {link} is already in the database. Skipping.")
             return None, f"- {link} (Already in queue)"
 
-        media_info = parse_filename(filename)
+        metadata = await loop.run_in_executor(None, get_link_metadata, link)
+        if not metadata:
+            log.error(f"Could not determine filename for link: {link}")
+            return None, f"- {link} (Could not get filename)"
+
+        filename = metadata['filename']
+        media_info = metadata['media_info']
         title = media_info.get('title', filename)
 
         if media_info.get('type') == 'tv_show' and media_info.get('season') is not None:
             title = f"{title} S{media_info['season']:02d}E{media_info['episode']:02d}"
 
-        request_id = database.add_request(
-            media_info.get('title', 'Unknown Title'),
-            media_info.get('type', 'unknown'),
-            media_info.get('season')
-        )
-
-        with database.get_db_conn() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO downloads (request_id, episode_number, quality, language, fichier_link, status) VALUES (?, ?, ?, ?, ?, ?)",
-                (request_id, media_info.get('episode'), media_info.get('quality'), media_info.get('language'), link, 'queued')
-            )
-            conn.commit()
-        
+        if await database.add_link_download_async(link, media_info) is None:
+            # The same link was queued from elsewhere while its metadata was being fetched.
+            log.warning(f"Link {link} is already in the database. Skipping.")
+            return None, f"- {link} (Already in queue)"
+
+        scheduler.notify()
         log.info(f"Successfully added '{title}' to the download queue via Telegram.")
         return title, None
 
@@ -342,9 +339,17 @@ async def handle_new_message(event):
         failure_links = []
         loop = asyncio.get_running_loop()
 
+        # Dead links are reported right away instead of being queued.
+        liveness = await loop.run_in_executor(None, check_links, unique_links)
         for link in unique_links:
-            log.info(f"Processing unique link: {link}")
-            title, error = await process_link(link, loop)
+            if liveness.get(link) is False:
+                failure_links.append(f"- {link} (File no longer exists)")
+        unique_links = [link for link in unique_links if liveness.get(link) is not False]
+
+        # Filename lookups run in parallel on the shared browser pool.
+        log.info(f"Processing {len(unique_links)} unique link(s).")
+        results = await asyncio.gather(*(process_link(link, loop) for link in unique_links))
+        for title, error in results:
             if title:
                 success_titles.append(title)
             if error:
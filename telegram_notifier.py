@@ -1,7 +1,14 @@
 import os
+import time
+import queue
+import atexit
 import asyncio
 import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import Future
 from telethon.sync import TelegramClient
+from telethon.errors import FloodWaitError
 from dotenv import load_dotenv
 
 import logger_setup
@@ -16,27 +23,178 @@ API_HASH = os.getenv('TELEGRAM_API_HASH')
 BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 CHAT_ID = os.getenv('TELEGRAM_GROUP_CHAT_ID')
 
-async def _send_message_async(message):
-    if not all([API_ID, API_HASH, BOT_TOKEN, CHAT_ID]):
-        log.warning("Telegram credentials not fully configured. Skipping notification.")
-        return
+# --- Notifier Configuration ---
+# Notifications queued within this many seconds of each other are sent as a single message.
+COALESCE_SECONDS = float(os.getenv('NOTIFY_COALESCE_SECONDS', 10))
+MAX_SEND_ATTEMPTS = 5
+# Telegram rejects longer messages.
+MAX_MESSAGE_LENGTH = 4096
+# How long pending notifications may hold up interpreter shutdown.
+CLOSE_TIMEOUT_SECONDS = 15
 
-    # Using a file for the session is required by Telethon
-    async with TelegramClient('bot_session', API_ID, API_HASH) as client:
-        await client.start(bot_token=BOT_TOKEN)
+Notification = namedtuple('Notification', ['message', 'series', 'episode', 'future'])
+
+class NotificationError(Exception):
+    """Set on a notification's Future when it could not be sent."""
+
+def compose_messages(batch):
+    """
+    Turns a batch of notifications into as few Telegram messages as possible.
+    Several episodes of the same series collapse into one line. Returns a list of
+    (message, notifications) pairs, so each notification is acknowledged with its message.
+    """
+    lines = []
+    episodes = {}
+    for notification in batch:
+        if notification.series is None:
+            lines.append([notification])
+            continue
+        if notification.series not in episodes:
+            episodes[notification.series] = []
+            # Keep the position of the series' first episode; the line is written once the batch is complete.
+            lines.append(episodes[notification.series])
+        episodes[notification.series].append(notification)
+
+    messages = []
+    for line in lines:
+        if len(line) == 1:
+            text = line[0].message
+        else:
+            labels = ', '.join(item.episode for item in line if item.episode)
+            text = f"{len(line)} episodes of '{line[0].series}' finished downloading{f' ({labels})' if labels else ''}. 📺"
+        if messages and len(messages[-1][0]) + len(text) + 2 <= MAX_MESSAGE_LENGTH:
+            messages[-1] = (f"{messages[-1][0]}\n\n{text}", messages[-1][1] + line)
+        else:
+            messages.append((text[:MAX_MESSAGE_LENGTH], list(line)))
+    return messages
+
+class TelegramNotifier:
+    """
+    Sends notifications from a single long-lived Telegram client.
+
+    Callers only put messages on an in-memory queue and get a Future that resolves once
+    the message is actually sent, or fails with NotificationError. A background thread
+    keeps one connected client, collects everything queued during COALESCE_SECONDS into
+    as few messages as possible and waits out Telegram's flood-wait delays before retrying.
+    """
+
+    def __init__(self, coalesce_seconds=COALESCE_SECONDS):
+        self.coalesce_seconds = coalesce_seconds
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._client = None
+        self._stats = {'queued': 0, 'sent_messages': 0, 'flood_waits': 0, 'dropped': 0}
+
+    def notify(self, message, series=None, episode=None):
+        """
+        Queues a notification and returns a Future for its delivery right away: True once
+        it is sent, False if it was skipped. `series` lets episodes of one show be coalesced.
+        """
+        future = Future()
+        if not all([API_ID, API_HASH, BOT_TOKEN, CHAT_ID]):
+            log.warning("Telegram credentials not fully configured. Skipping notification.")
+            future.set_result(False)
+            return future
+        log.info(f"Queueing Telegram notification: {message[:35]}")
+        self._stats['queued'] += 1
+        self._queue.put(Notification(message, series, episode, future))
+        self._ensure_started()
+        return future
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="TelegramNotifier", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        """Blocks for the next notification, then gathers the ones that follow it. Returns (batch, closing)."""
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.coalesce_seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return batch, False
+            try:
+                notification = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                return batch, False
+            if notification is None:
+                return batch, True
+            batch.append(notification)
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            closing = False
+            while not closing:
+                batch, closing = self._next_batch()
+                for message, notifications in compose_messages(batch):
+                    sent = self._deliver(loop, message)
+                    for notification in notifications:
+                        if sent:
+                            notification.future.set_result(True)
+                        else:
+                            notification.future.set_exception(NotificationError(f"Gave up after {MAX_SEND_ATTEMPTS} attempts"))
+        finally:
+            if self._client:
+                loop.run_until_complete(self._client.disconnect())
+            loop.close()
+
+    async def _send(self, message):
+        if self._client is None:
+            # Using a file for the session is required by Telethon
+            self._client = TelegramClient('bot_session', API_ID, API_HASH)
+        if not self._client.is_connected():
+            await self._client.start(bot_token=BOT_TOKEN)
         # The chat_id needs to be an integer for Telethon
-        await client.send_message(int(CHAT_ID), message)
-
-def send_notification(message):
-    """Synchronous wrapper for the async send_message function."""
-    log.info(f"Sending Telegram notification: {message[:35]}")
-    try:
-        # Create a new event loop to run the async function
-        # This is a simple way to call async from a sync thread
-        asyncio.run(_send_message_async(message))
-        log.info("Successfully sent Telegram notification.")
-    except Exception as e:
-        log.error(f"Failed to send Telegram notification: {e}", exc_info=True)
+        await self._client.send_message(int(CHAT_ID), message)
+
+    def _deliver(self, loop, message):
+        """Sends one message, retrying as needed. Returns whether it went out."""
+        for attempt in range(1, MAX_SEND_ATTEMPTS + 1):
+            try:
+                loop.run_until_complete(self._send(message))
+                self._stats['sent_messages'] += 1
+                log.info("Successfully sent Telegram notification.")
+                return True
+            except FloodWaitError as e:
+                self._stats['flood_waits'] += 1
+                log.warning(f"Telegram asked us to wait {e.seconds}s before sending again.")
+                time.sleep(e.seconds)
+            except Exception as e:
+                log.error(f"Failed to send Telegram notification (attempt {attempt}/{MAX_SEND_ATTEMPTS}): {e}", exc_info=True)
+                # Start over with a fresh connection on the next attempt.
+                try:
+                    loop.run_until_complete(self._client.disconnect())
+                except Exception:
+                    pass
+                time.sleep(min(60, 2 ** attempt))
+        self._stats['dropped'] += 1
+        log.error(f"Giving up on Telegram notification: {message[:35]}")
+        return False
+
+    def close(self, timeout=CLOSE_TIMEOUT_SECONDS):
+        """Sends what is still queued and disconnects, waiting at most `timeout` seconds."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def stats(self):
+        return dict(self._stats, pending=self._queue.qsize())
+
+notifier = TelegramNotifier()
+atexit.register(notifier.close)
+
+def send_notification(message, series=None, episode=None):
+    """Queues a Telegram notification without waiting for it to be sent. Returns a Future for its delivery."""
+    return notifier.notify(message, series, episode)
 
 if __name__ == '__main__':
     # This allows for testing the notifier directly
@@ -47,4 +205,5 @@ if __name__ == '__main__':
     log.info(f"BOT_TOKEN: {'*' * 5 if BOT_TOKEN else 'Not Set'}")
     log.info(f"CHAT_ID: {CHAT_ID if CHAT_ID else 'Not Set'}")
     log.info("Sending a test notification...")
-    send_notification("Hello from Harvester! This is a test notification.")
\ No newline at end of file
+    send_notification("Hello from Harvester! This is a test notification.")
+    notifier.close()
@@ -0,0 +1,137 @@
+import os
+import queue
+import logging
+import threading
+import requests
+import http.client
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1048576
+# Buffers in flight between the network reader and the disk writer.
+BUFFER_COUNT = 8
+
+def preallocate(f, size):
+    """Reserves `size` bytes for an open file so the disk does not fragment or fill up mid-transfer."""
+    if size <= 0:
+        return
+    try:
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(f.fileno(), 0, size)
+            return
+    except OSError as e:
+        log.debug(f"posix_fallocate is not supported here, falling back to truncate: {e}")
+    f.truncate(size)
+
+class TransferWriter:
+    """
+    Writes a response body to disk on a dedicated thread.
+
+    The network side reads straight into a small pool of reusable buffers and hands them
+    to the writer thread, so a slow disk never stalls the socket (and vice versa) until
+    all buffers are in flight. If a `hasher` is given, every chunk is fed to it right
+    before it is written, so the content hash costs no extra read pass.
+    """
+
+    def __init__(self, path, offset=0, total_size=0, buffer_count=BUFFER_COUNT, buffer_size=CHUNK_SIZE, hasher=None):
+        self.path = path
+        self.hasher = hasher
+        self.position = offset
+        self.buffer_size = buffer_size
+        self.error = None
+
+        self._file = open(path, 'r+b' if offset > 0 else 'wb', buffering=0)
+        self._file.seek(offset)
+        self._file.truncate()
+        preallocate(self._file, total_size)
+        self._file.seek(offset)
+
+        self._free = queue.Queue()
+        for _ in range(buffer_count):
+            self._free.put(bytearray(buffer_size))
+        self._pending = queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop, name=f"{threading.current_thread().name}-writer", daemon=True)
+        self._thread.start()
+
+    def _write_loop(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            buffer, length = item
+            try:
+                if self.error is None:
+                    view = memoryview(buffer)[:length]
+                    if self.hasher:
+                        self.hasher.update(view)
+                    # An unbuffered file may take fewer bytes than offered.
+                    while view:
+                        view = view[self._file.write(view):]
+                    self.position += length
+            except OSError as e:
+                self.error = e
+            finally:
+                self._free.put(buffer)
+
+    def _raise_if_failed(self):
+        if self.error is not None:
+            raise self.error
+
+    def _take_buffer(self):
+        while True:
+            self._raise_if_failed()
+            try:
+                return self._free.get(timeout=1)
+            except queue.Empty:
+                continue
+
+    def chunks(self, response):
+        """Reads `response` into pooled buffers, queues them for writing and yields the size of each chunk."""
+        # urllib3's own readinto() copies through an intermediate buffer, so read from the
+        # underlying http.client response when the body needs no decoding.
+        body = getattr(response.raw, '_fp', None)
+        if response.headers.get('content-encoding', 'identity') != 'identity' or not hasattr(body, 'readinto'):
+            for chunk in response.iter_content(chunk_size=self.buffer_size):
+                # Decoded chunks are copied into the pool too, so a slow disk holds back the reads here as well.
+                chunk = memoryview(chunk)
+                for start in range(0, len(chunk), self.buffer_size):
+                    piece = chunk[start:start + self.buffer_size]
+                    buffer = self._take_buffer()
+                    buffer[:len(piece)] = piece
+                    self._pending.put((buffer, len(piece)))
+                yield len(chunk)
+            return
+
+        while True:
+            buffer = self._take_buffer()
+            try:
+                length = body.readinto(buffer)
+            except (http.client.HTTPException, OSError) as e:
+                self._free.put(buffer)
+                raise requests.exceptions.ConnectionError(e)
+            if not length:
+                self._free.put(buffer)
+                return
+            self._pending.put((buffer, length))
+            yield length
+
+    def close(self):
+        """Waits for queued writes to reach the file, then closes it."""
+        self._pending.put(None)
+        self._thread.join()
+        self._file.close()
+        self._raise_if_failed()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Don't mask the original error with a write failure.
+            try:
+                self.close()
+            except OSError:
+                pass
+        return False